@@ -1,10 +1,33 @@
+import re
 import logging
 from gym.envs.registration import register
 
+from . import envs
+from .envs.chip8_env import get_games
+
 logger = logging.getLogger(__name__)
 
-register(
-    id='Chip8Brix-v0',
-    entry_point='gym_chip8.envs:Chip8BrixEnv',
-    timestep_limit=100000,
-)
\ No newline at end of file
+
+def get_env_name(game):
+    # e.g. Chip8Brix for BRIX
+    return 'Chip8' + ''.join(part.title() for part in re.split('[^A-Za-z0-9]+', game))
+
+
+# One env per profile in envs/roms. Games with their own class, such as
+# Chip8BrixEnv, use it, the others use Chip8Env, which gets the reward and
+# the end of episodes from their profile.
+for game in get_games():
+    name = get_env_name(game)
+    if hasattr(envs, name + 'Env'):
+        register(
+            id=name + '-v0',
+            entry_point='gym_chip8.envs:%sEnv' % name,
+            timestep_limit=100000,
+        )
+    else:
+        register(
+            id=name + '-v0',
+            entry_point='gym_chip8.envs:Chip8Env',
+            kwargs={'game': game},
+            timestep_limit=100000,
+        )
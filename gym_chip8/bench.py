@@ -0,0 +1,331 @@
+"""Throughput benchmarks for the CHIP-8 emulator.
+
+Run with ``python -m gym_chip8.bench`` or ``gym-chip8-bench``, add
+``--json`` to get the results as JSON, e.g. to track regressions.
+"""
+import os
+import sys
+import json
+import time
+import struct
+import timeit
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from .envs.core.vm import VM
+from .envs.core.pool import VMPool
+from .envs.core.constants import PROGRAM_OFFSET
+from .envs.chip8_env import Chip8BrixEnv
+from .envs.recorder import TrajectoryRecorder, TrajectoryReader
+from .envs.observation import ObservationPipeline
+from .envs.rendering import Renderer
+from .envs.video import VideoRecorder
+
+ROMS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'envs', 'roms')
+
+# Number of instructions in the loop of the synthetic ROMs
+LOOP_LENGTH = 64
+
+# Synthetic ROMs, one per opcode class: (setup, instruction). The setup
+# instructions run once, then the instruction is repeated in a loop. It may
+# be a function of its address and of the address of a subroutine that
+# just returns. None of them skip or leave the loop.
+OPCODE_CLASSES = {
+    '00E0': ((), 0x00E0),
+    '1nnn': ((), lambda address, subroutine: 0x1000 | (address + 2)),
+    '2nnn/00EE': ((), lambda address, subroutine: 0x2000 | subroutine),
+    '3xkk': ((), 0x3A01),
+    '4xkk': ((), 0x4A00),
+    '5xy0': ((0x6B01,), 0x5AB0),
+    '6xkk': ((), 0x6A12),
+    '7xkk': ((), 0x7A01),
+    '8xy4': ((0x6B03,), 0x8AB4),
+    '9xy0': ((), 0x9AB0),
+    'Annn': ((), 0xA300),
+    'Bnnn': ((), lambda address, subroutine: 0xB000 | (address + 2)),
+    'Cxkk': ((), 0xCAFF),
+    'Dxyn': ((), 0xDAB5),
+    'Ex9E': ((), 0xEA9E),
+    'Fx1E': ((0x6A01,), 0xFA1E),
+    'Fx33': ((0xA300,), 0xFA33),
+    'Fx55': ((0xA300,), 0xF355),
+    'Fx65': ((0xA300,), 0xF365),
+}
+
+# A mix of the common arithmetic, memory and drawing instructions
+MIXED = ((0x6B01,), (0x7A01, 0x8AB4, 0x3A00, 0xA300, 0xFA1E, 0xF165, 0x8AB2, 0xDAB5, 0x4B01))
+
+
+def make_loop_rom(instructions, setup=(), length=LOOP_LENGTH):
+    # Cycle through the instructions in a loop of the given length, followed
+    # by a jump back to its start and a subroutine that just returns
+    start = PROGRAM_OFFSET + 2 * len(setup)
+    subroutine = start + 2 * length + 2
+    opcodes = list(setup)
+    for index in range(length):
+        instruction = instructions[index % len(instructions)]
+        if callable(instruction):
+            instruction = instruction(start + 2 * index, subroutine)
+        opcodes.append(instruction)
+    opcodes += [0x1000 | start, 0x00EE]
+    return struct.pack('>%dH' % len(opcodes), *opcodes)
+
+
+def make_vm(game='BRIX', **vm_kwargs):
+    vm = VM(frame_limiting=False, **vm_kwargs)
+    vm.load_rom_profile(os.path.join(ROMS_PATH, '%s.json' % game))
+    return vm
+
+
+def make_synthetic_vm(rom, **vm_kwargs):
+    vm = VM(frame_limiting=False, **vm_kwargs)
+    vm.load_rom_data(rom)
+    return vm
+
+
+def best_rate(func, number, repeat):
+    # Calls per second of the fastest run
+    return number / min(timeit.repeat(func, number=number, repeat=repeat))
+
+
+def bench_cpu_step(game='BRIX', number=20000, repeat=5):
+    vm = make_vm(game)
+    return best_rate(vm.cpu.step, number, repeat)
+
+
+def bench_opcode_classes(number=20000, repeat=5):
+    # Instructions per second of CPU.step for each synthetic ROM
+    rates = dict()
+    for name, (setup, instruction) in OPCODE_CLASSES.items():
+        vm = make_synthetic_vm(make_loop_rom((instruction,), setup))
+        rates[name] = best_rate(vm.cpu.step, number, repeat)
+    vm = make_synthetic_vm(make_loop_rom(MIXED[1], MIXED[0]))
+    rates['mixed'] = best_rate(vm.cpu.step, number, repeat)
+    return rates
+
+
+def bench_vm_cycle(game='BRIX', number=2000, repeat=5, cpu_mode='interpreter'):
+    vm = make_vm(game, cpu_mode=cpu_mode)
+    return best_rate(vm.cycle, number, repeat)
+
+
+def bench_vm_reset(game='BRIX', number=2000, repeat=5, **vm_kwargs):
+    # Resets per second, back to the boot snapshot of the profile
+    vm = make_vm(game, **vm_kwargs)
+    return best_rate(vm.reset, number, repeat)
+
+
+def bench_env_reset(number=2000, repeat=5, **env_kwargs):
+    env = Chip8BrixEnv(**env_kwargs)
+    return best_rate(env.reset, number, repeat)
+
+
+def bench_env_step(number=2000, repeat=5, **env_kwargs):
+    env = Chip8BrixEnv(**env_kwargs)
+    return best_rate(lambda: env.step(1), number, repeat)
+
+
+def bench_pool_step(game='BRIX', count=64, number=200, repeat=5, **pool_kwargs):
+    # VM cycles per second of a VMPool stepping count VMs
+    pool = VMPool([make_vm(game) for _ in range(count)], **pool_kwargs)
+    pool.step()
+    rate = best_rate(pool.step, number, repeat) * count
+    pool.close()
+    return rate
+
+
+def bench_render(number=2000, repeat=5, **env_kwargs):
+    # Calls per second of render('rgb_array'), after a few steps
+    env = Chip8BrixEnv(**env_kwargs)
+    for _ in range(100):
+        env.step(1)
+    return best_rate(lambda: env.render('rgb_array'), number, repeat)
+
+
+def bench_render_frames(count=None, number=2000, repeat=5, scale=8):
+    # Full frames rendered per second, by Renderer.render_buffer or, with
+    # count, by Renderer.mosaic of count displays at once
+    renderer = Renderer(scale=scale)
+    random_state = np.random.RandomState(0)
+    if count is None:
+        buffer = random_state.randint(0, 2, size=(32, 64)).astype(np.uint8)
+        image = np.empty(renderer.shape, dtype=np.uint8)
+        return best_rate(lambda: renderer.render_buffer(buffer, image), number, repeat)
+    buffers = random_state.randint(0, 2, size=(count, 32, 64)).astype(np.uint8)
+    return best_rate(lambda: renderer.mosaic(buffers), max(1, number // count), repeat) * count
+
+
+def bench_record(steps=2000, repeat=5, batch_size=32, stack=4):
+    # Steps per second while recording, and minibatches per second sampled
+    # from the recording
+    with tempfile.TemporaryDirectory() as directory:
+        env = TrajectoryRecorder(Chip8BrixEnv(), directory)
+        env.reset()
+        record_rate = best_rate(lambda: env.step(1), steps, repeat)
+        env.close()
+
+        reader = TrajectoryReader(directory)
+        sample_rate = best_rate(lambda: reader.sample(batch_size, stack), max(1, steps // 10), repeat)
+        del reader
+    return record_rate, sample_rate
+
+
+def bench_video(extension, steps=2000, repeat=5):
+    # Steps per second while streaming the frames to a video file
+    with tempfile.TemporaryDirectory() as directory:
+        env = VideoRecorder(Chip8BrixEnv(), os.path.join(directory, 'video' + extension))
+        env.reset()
+        rate = best_rate(lambda: env.step(1), steps, repeat)
+        env.close()
+    return rate
+
+
+def bench_fork_memory(game='BRIX', count=100000, paged_memory=True, cycles=1):
+    # Bytes allocated per forked VM, each fork running a few cycles
+    vm = make_vm(game, paged_memory=paged_memory)
+    for _ in range(100):
+        vm.cycle()
+
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    forks = []
+    for _ in range(count):
+        fork = vm.fork()
+        for _ in range(cycles):
+            fork.cycle()
+        forks.append(fork)
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+
+    return used / count
+
+
+def bench_step_allocations(steps=1000, **env_kwargs):
+    # Blocks and bytes still allocated, and peak bytes allocated, per env
+    # step once warmed up
+    env = Chip8BrixEnv(**env_kwargs)
+    for index in range(100):
+        env.step(index % 3)
+
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    peak = 0
+    for index in range(steps):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        env.step(index % 3)
+        peak += tracemalloc.get_traced_memory()[1] - current
+    end = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = end.compare_to(start, 'lineno')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    return blocks / steps, size / steps, peak / steps
+
+
+def run(scale=1.0, forks=100000):
+    # Run all the benchmarks, scale multiplies the number of iterations,
+    # forks included
+    def n(number):
+        return max(1, int(number * scale))
+
+    results = dict()
+    results['cpu_step'] = bench_cpu_step(number=n(20000))
+    results['cpu_step_opcode_classes'] = bench_opcode_classes(number=n(20000))
+    results['vm_cycle'] = dict((cpu_mode, bench_vm_cycle(number=n(2000), cpu_mode=cpu_mode))
+                               for cpu_mode in ('interpreter', 'jit'))
+    results['vm_reset'] = bench_vm_reset(number=n(2000))
+    results['env_reset'] = dict(('headless=%s' % headless, bench_env_reset(number=n(2000), headless=headless))
+                                for headless in (False, True))
+    results['pool_step'] = dict(('%s, max_workers=%d' % (mode, max_workers),
+                                 bench_pool_step(number=n(200), max_workers=max_workers, use_kernel=use_kernel))
+                                for mode, use_kernel in (('kernel', True), ('interpreter', False))
+                                for max_workers in (1, os.cpu_count() or 1))
+    results['env_step'] = dict(('frameskip=%d' % frameskip, bench_env_step(number=n(2000), frameskip=frameskip))
+                               for frameskip in (0, 3))
+    results['env_step']['observation_buffers=2'] = bench_env_step(number=n(2000), observation_buffers=2)
+    results['env_step']['pipeline (downscale=2, stack=4, float32)'] = bench_env_step(
+        number=n(2000), pipeline=ObservationPipeline(downscale=2, stack=4, output='float32'))
+    results['render_rgb_array'] = bench_render(number=n(2000))
+    results['render_frames'] = dict((name, bench_render_frames(count, number=n(2000)))
+                                    for name, count in (('render_buffer', None), ('mosaic of 16', 16)))
+    results['record_steps'], results['sample_batches'] = bench_record(steps=n(2000))
+    results['video_steps'] = dict((extension, bench_video(extension, steps=n(2000)))
+                                  for extension in ('.gif', '.y4m'))
+    results['fork_bytes'] = dict(('paged_memory=%s' % paged_memory,
+                                  bench_fork_memory(count=n(forks), paged_memory=paged_memory))
+                                 for paged_memory in (False, True))
+    results['step_allocations'] = dict(
+        ('observation_buffers=%s' % observation_buffers,
+         dict(zip(('blocks', 'bytes', 'peak_bytes'),
+                  bench_step_allocations(steps=n(1000), observation_buffers=observation_buffers))))
+        for observation_buffers in (None, 2))
+    return results
+
+
+def print_results(results):
+    print('CPU.step: %12.0f instructions/s' % results['cpu_step'])
+    for name, rate in results['cpu_step_opcode_classes'].items():
+        print('CPU.step (%s): %12.0f instructions/s' % (name, rate))
+    for cpu_mode, rate in results['vm_cycle'].items():
+        print('VM.cycle (%s): %12.0f cycles/s' % (cpu_mode, rate))
+    print('VM.reset: %12.0f resets/s' % results['vm_reset'])
+    for options, rate in results['env_reset'].items():
+        print('Env.reset (%s): %8.0f resets/s' % (options, rate))
+    for options, rate in results['pool_step'].items():
+        print('VMPool.step (%s): %12.0f cycles/s' % (options, rate))
+    for options, rate in results['env_step'].items():
+        print('Env.step (%s): %8.0f steps/s' % (options, rate))
+    print('Env.render (rgb_array): %8.0f renders/s' % results['render_rgb_array'])
+    for name, rate in results['render_frames'].items():
+        print('Renderer (%s): %8.0f frames/s' % (name, rate))
+    print('TrajectoryRecorder.step: %8.0f steps/s' % results['record_steps'])
+    for extension, rate in results['video_steps'].items():
+        print('VideoRecorder.step (%s): %8.0f steps/s' % (extension, rate))
+    print('TrajectoryReader.sample (32x4 frames): %8.0f batches/s' % results['sample_batches'])
+    for options, size in results['fork_bytes'].items():
+        print('VM.fork (%s): %8.0f bytes/fork' % (options, size))
+    for options, allocations in results['step_allocations'].items():
+        print('Env.step (%s): %.1f blocks, %.0f bytes retained, %.0f bytes peak per step' % (
+            options, allocations['blocks'], allocations['bytes'], allocations['peak_bytes']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Throughput benchmarks for gym-chip8')
+    parser.add_argument('--json', metavar='PATH', nargs='?', const='-',
+                        help='write the results as JSON to PATH, or to stdout')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the number of iterations, e.g. 0.1 for a quick run')
+    parser.add_argument('--forks', type=int, default=100000,
+                        help='number of VMs forked by the fork memory cases, before --scale')
+    args = parser.parse_args(argv)
+
+    results = run(args.scale, args.forks)
+    if args.json is None:
+        print_results(results)
+        return
+
+    report = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'scale': args.scale,
+        'forks': args.forks,
+        'results': results,
+    }
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.json, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
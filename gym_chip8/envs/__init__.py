@@ -1 +1,9 @@
-from .chip8_env import Chip8Env, Chip8BrixEnv
\ No newline at end of file
+from .chip8_env import Chip8Env, Chip8BrixEnv
+from .vector_env import Chip8VectorEnv, Chip8BrixVectorEnv
+from .subproc_vector_env import SubprocVectorEnv
+from .recorder import TrajectoryRecorder, TrajectoryReader
+from .replay import Replay
+from .async_env import AsyncChip8Env
+from .observation import ObservationPipeline
+from .rendering import Renderer
+from .video import VideoRecorder
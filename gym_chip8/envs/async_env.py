@@ -0,0 +1,36 @@
+from .core.async_vm import AsyncVM
+
+
+class AsyncChip8Env(object):
+    '''Steps a Chip8Env in real time from a coroutine.
+
+    A step of the env runs frameskip + 1 cycles, so it takes as many ticks
+    of the clock. Envs sharing a clock, the default, are woken by a single
+    timer per tick. policy and max_lag handle late steps, see AsyncVM.
+
+        env = AsyncChip8Env(Chip8BrixEnv())
+        observation = await env.reset()
+        observation, reward, done, info = await env.step(action)
+    '''
+
+    def __init__(self, env, clock=None, policy='catch_up', max_lag=5):
+        self.env = env
+        self._vm = AsyncVM(env.unwrapped.vm, clock, policy, max_lag)
+        self.action_space = env.action_space
+        self.observation_space = env.observation_space
+
+    async def reset(self):
+        observation = self.env.reset()
+        # reset replaces the VM state, the next step starts on the next tick
+        self._vm.restart()
+        return observation
+
+    async def step(self, action):
+        await self._vm.wait(self.env.unwrapped.frameskip + 1)
+        return self.env.step(action)
+
+    def render(self, *args, **kwargs):
+        return self.env.render(*args, **kwargs)
+
+    def close(self):
+        return self.env.close()
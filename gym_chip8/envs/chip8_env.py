@@ -8,39 +8,119 @@ from gym import utils
 
 from gym.utils import seeding
 
-from .core.vm import VM
+from .core.vm import VM, RAM_SIZE
+from .core.profile import load_rom_profile, find_rom_profiles
 from .core.constants import *
+from .rendering import Renderer
 
 import logging
 logger = logging.getLogger(__name__)
 
-SCALE = 8
+ROMS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'roms')
+
+
+def get_rom_profile_path(game):
+    path = os.path.join(ROMS_PATH, "%s.json" % game)
+    if not os.path.exists(path):
+        raise IOError('You asked for game %s but path %s does not exist' % (game, path))
+    return path
+
+
+def get_rom_profile(game):
+    # Parsed once, see RomProfile
+    return load_rom_profile(get_rom_profile_path(game))
+
+
+def get_games():
+    # Names of the games with a profile in ROMS_PATH
+    return list(find_rom_profiles(ROMS_PATH))
 
 
 class Chip8Env(gym.Env):
     metadata = {'render.modes': ['human', 'rgb_array']}
 
-    def __init__(self, game, frameskip=0):
+    def __init__(self, game, frameskip=0, max_pool=False, observation_buffers=None, headless=False, boot_frames=0,
+                 pipeline=None, renderer=None, **vm_kwargs):
         self.frameskip = frameskip
+        # Episodes start boot_frames cycles after the ROM is loaded
+        self.boot_frames = boot_frames
+        # Return the pixelwise maximum of the last two skipped frames
+        self.max_pool = max_pool
         self.viewer = None
-
-        dir_path = os.path.dirname(os.path.realpath(__file__))
-        path = os.path.join(dir_path, "roms/%s.json" % game)
-        if not os.path.exists(path):
-            raise IOError('You asked for game %s but path %s does not exist' % (game, path))
-        self._rom_profile_path = path
-
-        self.vm = VM(frame_limiting=False)
+        # Headless envs skip the display work and observe the RAM, see VM.get_ram
+        self.headless = headless
+        if headless:
+            observation_shape = (RAM_SIZE,)
+        else:
+            observation_shape = (SCREEN_ROWS, SCREEN_COLS)
+
+        # Opt-in buffer reuse: either a ring size or a sequence of caller
+        # supplied uint8 arrays of the observation shape. Observations are
+        # then written in turn into the ring and returned as read-only views,
+        # which are overwritten once the ring wraps around. The rendered
+        # image is then returned as a read-only view instead of a copy.
+        self._observations = None
+        if observation_buffers is not None:
+            if isinstance(observation_buffers, int):
+                observation_buffers = [np.zeros(observation_shape, dtype=np.uint8)
+                                       for _ in range(observation_buffers)]
+            self._observations = [(buffer, self._make_read_only(buffer)) for buffer in observation_buffers]
+            self._observation_index = 0
+            self._info = dict()
+
+        # Optional ObservationPipeline preprocessing the displays, its
+        # observations replace the display buffers
+        self.pipeline = pipeline
+        if pipeline is not None and (headless or observation_buffers is not None):
+            raise ValueError('An observation pipeline needs a display and its own buffers')
+        self._pipeline_buffer = np.zeros((SCREEN_ROWS, SCREEN_COLS), dtype=np.uint8)
+
+        # Renderer of the images, its scale and palette are configurable.
+        # It only renders the rows drawn since the last render.
+        self.renderer = renderer if renderer is not None else Renderer()
+        self._img_view = self._make_read_only(self.renderer.image)
+
+        self.game = game
+        self._rom_profile = get_rom_profile(game)
+
+        # Extra keyword arguments select VM options, e.g. display_class
+        self.vm = VM(frame_limiting=False, headless=headless, **vm_kwargs)
+        self.vm.load_profile(self._rom_profile, boot_frames)
+        self._seed()
         self.reset()
 
         self.action_space = spaces.Discrete(self.vm.get_num_actions())
-        self.observation_space = spaces.Box(low=0, high=1, shape=(SCREEN_ROWS, SCREEN_COLS))
+        if headless:
+            self.observation_space = spaces.Box(low=0, high=255, shape=observation_shape)
+        elif pipeline is not None:
+            self.observation_space = pipeline.observation_space
+        else:
+            self.observation_space = spaces.Box(low=0, high=1, shape=observation_shape)
 
     def _get_frame_reward(self, frame):
-        raise NotImplementedError
+        # Called after every cycle, including skipped ones. Only the last
+        # frame of a step has a buffer, the others only provide variables,
+        # a record of the VM variables array indexed by name. By default,
+        # the reward is the increase of the profile "reward" variable.
+        name = self._rom_profile.reward
+        if name is None:
+            raise NotImplementedError
+        value = frame.variables[name]
+        reward = max(0, value - self._previous_reward_value)
+        self._previous_reward_value = value
+        return reward
 
     def _get_done(self, frame):
-        raise NotImplementedError
+        # By default, done once the profile "done" variable has its value
+        done = self._rom_profile.done
+        if done is None:
+            raise NotImplementedError
+        return frame.cycle_index > 0 and frame.variables[done["variable"]] == done["value"]
+
+    def _read_previous_reward_value(self):
+        # The reward baseline is the current value of the reward variable
+        name = self._rom_profile.reward
+        self._previous_reward_value = self.vm.get_variable(name) if name is not None else 0
 
     def _step(self, action):
         if self.frameskip:
@@ -48,35 +128,74 @@ class Chip8Env(gym.Env):
         else:
             num_steps = 1
 
-        frame = None
-        reward = 0
-        for _ in range(num_steps):
-            self.vm.take_action(action)
-            frame = next(self.vm.frames())
-            reward += self._get_frame_reward(frame)
+        self.actions.append(action)
+        self._step_reward = 0
+        if self.pipeline is not None:
+            frame = self.vm.run_cycles(num_steps, action, self._add_frame_reward, self.max_pool,
+                                       out=self._pipeline_buffer)
+            observation = self.pipeline.step(frame.buffer)
+            info = dict(zip(frame.variables.dtype.names, frame.variables.item()))
+        elif self._observations is None:
+            frame = self.vm.run_cycles(num_steps, action, self._add_frame_reward, self.max_pool)
+            observation = frame.buffer
+            info = dict(zip(frame.variables.dtype.names, frame.variables.item()))
+        else:
+            buffer, observation = self._observations[self._observation_index]
+            self._observation_index = (self._observation_index + 1) % len(self._observations)
+            frame = self.vm.run_cycles(num_steps, action, self._add_frame_reward, self.max_pool, out=buffer)
+            # The info dict is reused as well
+            info = self._info
+            for name in frame.variables.dtype.names:
+                info[name] = frame.variables[name]
 
-        observation = frame.buffer
         done = self._get_done(frame)
 
-        return observation, reward, done, frame.variables
+        return observation, self._step_reward, done, info
+
+    @staticmethod
+    def _make_read_only(buffer):
+        view = buffer.view()
+        view.flags.writeable = False
+        return view
+
+    def _add_frame_reward(self, frame):
+        self._step_reward += self._get_frame_reward(frame)
 
     def _get_img(self):
-        im = self.vm.get_display_buffer()
-        # Scale the 2D array before converting to RGB
-        im = np.kron(im, np.ones((SCALE, SCALE)))
-        w, h = im.shape
-        ret = np.empty((w, h, 3), dtype=np.uint8)
-        ret[:, :, 0] = im*255
-        ret[:, :, 1] = im*255
-        ret[:, :, 2] = im*255
+        img = self.renderer.render(self.vm.get_display())
+        if self._observations is None:
+            return img.copy()
+        return self._img_view
 
-        return ret
+    def _seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
 
     def _reset(self):
-        self.vm.reset()
-        self.vm.load_rom_profile(self._rom_profile_path)
+        # Every episode gets its own seed drawn from np_random. The episode
+        # can be replayed from it and the actions, see Replay.
+        self.episode_seed = int(self.np_random.randint(0, 2**63 - 1, dtype=np.int64))
+        self.actions = []
+        self.vm.reset(seed=self.episode_seed)
+        self._read_previous_reward_value()
+        if self.headless:
+            return self.vm.get_ram()
+        if self.pipeline is not None:
+            return self.pipeline.reset(self.vm.get_display().buffer)
         return self._get_img()
 
+    def clone_state(self):
+        # Snapshot of the emulator, see VM.snapshot, and the length of the
+        # action log, so that the episode can still be replayed once the
+        # state is restored
+        return self.vm.snapshot(), len(self.actions)
+
+    def restore_state(self, state):
+        snapshot, num_actions = state
+        self.vm.restore(snapshot)
+        del self.actions[num_actions:]
+        self._read_previous_reward_value()
+
     def get_keys_to_action(self):
         # Used by gym.utils.play
         actions = ((),) + tuple((ord(c),) for c in "1234qwerasdfzxcv")
@@ -104,6 +223,14 @@ class Chip8BrixEnv(Chip8Env):
         super().__init__('BRIX', *args, **kwargs)
         self._previous_score = 0
 
+    def clone_state(self):
+        # The previous score is needed to compute the next reward
+        return super().clone_state(), self._previous_score
+
+    def restore_state(self, state):
+        snapshot, self._previous_score = state
+        super().restore_state(snapshot)
+
     def get_keys_to_action(self):
         actions = ((),) + tuple((ord(c),) for c in "qe")
         return dict([(v, k) for k, v in enumerate(actions)])
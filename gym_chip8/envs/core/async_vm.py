@@ -0,0 +1,111 @@
+import asyncio
+
+from . import constants
+from .pacing import FrameLimiter
+
+# Clocks shared by the VMs created without one, by frequency
+_shared_clocks = {}
+
+
+def get_shared_clock(frequency=constants.FREQUENCY):
+    if frequency not in _shared_clocks:
+        _shared_clocks[frequency] = FrameClock(frequency)
+    return _shared_clocks[frequency]
+
+
+class FrameClock(object):
+    '''Ticks at a fixed frequency on the event loop timer.
+
+    Tick n starts at start + n / frequency, so waiting never accumulates
+    drift. All the coroutines waiting for the same tick share a single
+    future and a single timer, so a clock can pace hundreds of VMs.
+    '''
+
+    def __init__(self, frequency=constants.FREQUENCY):
+        self.period = 1.0 / frequency
+        self._loop = None
+        self._start = None
+        self._waiters = dict()
+
+    def _get_loop(self):
+        loop = asyncio.get_event_loop()
+        if loop is not self._loop:
+            # Restart the ticks on a new loop, its timer has another origin
+            self._loop = loop
+            self._start = loop.time()
+            self._waiters = dict()
+        return loop
+
+    def get_tick(self):
+        # Index of the current tick
+        loop = self._get_loop()
+        return int((loop.time() - self._start) / self.period)
+
+    async def wait(self, tick):
+        # Wait until tick starts. Ticks already started return after
+        # yielding to the loop, so late sessions don't starve the others.
+        loop = self._get_loop()
+        deadline = self._start + tick * self.period
+        if loop.time() >= deadline:
+            await asyncio.sleep(0)
+            return
+
+        future = self._waiters.get(tick)
+        if future is None:
+            future = self._waiters[tick] = loop.create_future()
+            loop.call_at(deadline, self._wake, tick)
+        await asyncio.shield(future)
+
+    def _wake(self, tick):
+        future = self._waiters.pop(tick, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+
+class AsyncVM(object):
+    '''Runs a VM at the clock frequency from a coroutine.
+
+    Cycles are scheduled on tick indices. When a session falls behind (e.g.
+    a slow consumer of frames or a stalled event loop), the 'catch_up'
+    policy runs its late cycles back to back, up to max_lag ticks, and
+    'drop' gives up on them and realigns the schedule on the current tick,
+    as FrameLimiter does.
+    '''
+
+    def __init__(self, vm, clock=None, policy='catch_up', max_lag=5):
+        if policy not in FrameLimiter.POLICIES:
+            raise ValueError('Unknown pacing policy: %s' % policy)
+        self.vm = vm
+        # Pacing is done by the clock instead of sleeping in VM.cycle
+        vm.disable_frame_limiting()
+        self.clock = clock if clock is not None else get_shared_clock()
+        self.policy = policy
+        self.max_lag = max_lag
+        self.dropped_ticks = 0
+        self._tick = None
+
+    def restart(self):
+        # Schedule the next cycle on the next tick
+        self._tick = None
+
+    async def wait(self, ticks=1):
+        # Wait for the tick of the next cycle, and reserve ticks for it
+        if self._tick is None:
+            self._tick = self.clock.get_tick() + 1
+        else:
+            # Number of ticks the session is behind the schedule
+            behind = self.clock.get_tick() - self._tick
+            if behind > 0 and (self.policy == 'drop' or behind > self.max_lag):
+                self._tick += behind
+                self.dropped_ticks += behind
+        await self.clock.wait(self._tick)
+        self._tick += ticks
+
+    async def cycle(self):
+        await self.wait()
+        self.vm.cycle()
+
+    async def frames(self):
+        while True:
+            await self.cycle()
+            yield self.vm.get_frame()
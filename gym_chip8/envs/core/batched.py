@@ -0,0 +1,314 @@
+import numpy as np
+from . import constants
+from .display import SPRITE_ROWS
+from .state import FONT, seed_rng
+from .vm import NO_ACTION
+from .profile import load_rom_profile
+
+ADDRESS_MASK = constants.MEMORY_SIZE - 1
+
+
+class BatchedVM():
+    '''N CHIP-8 machines stepped in lockstep.
+
+    Memory, registers and framebuffers are stored as arrays with a leading
+    axis of size N, and every instruction is executed across all machines
+    with masked vectorized operations. Out of range memory addresses and
+    stack pointers wrap around instead of raising.
+    '''
+
+    def __init__(self, num_envs, seed=None):
+        self.num_envs = num_envs
+        self._profile = {}
+        self._variables = {}
+        self._action_keys = np.array([NO_ACTION])
+        self.np_random = np.random.RandomState(seed)
+
+        N = num_envs
+        self.memory = np.zeros((N, constants.MEMORY_SIZE), dtype=np.uint8)
+        self.display = np.zeros((N, constants.SCREEN_ROWS, constants.SCREEN_COLS), dtype=np.uint8)
+        self.keyboard = np.zeros((N, 16), dtype=np.bool_)
+        self.V = np.zeros((N, 16), dtype=np.uint8)
+        self.stack = np.zeros((N, 16), dtype=np.int64)
+        self.I = np.zeros(N, dtype=np.int64)
+        self.SP = np.zeros(N, dtype=np.int64)
+        self.PC = np.zeros(N, dtype=np.int64)
+        self.DT = np.zeros(N, dtype=np.int64)
+        self.ST = np.zeros(N, dtype=np.int64)
+        self.cycle_index = np.zeros(N, dtype=np.int64)
+        # RND state of each machine, the 64-bit LCG of op_Cxkk seeded by
+        # the episode seed of the machine
+        self.rng = np.zeros(N, dtype=np.uint64)
+        self.episode_seeds = np.zeros(N, dtype=np.int64)
+        self._pressed_keys = np.full(N, NO_ACTION, dtype=np.int64)
+        self._envs = np.arange(N)
+
+        # Memory image right after boot: the font plus the ROM, if any
+        self._boot_memory = np.zeros(constants.MEMORY_SIZE, dtype=np.uint8)
+        offset = constants.FONT_OFFSET
+        self._boot_memory[offset:offset+len(FONT)] = np.frombuffer(FONT, dtype=np.uint8)
+
+        self.reset()
+
+    def reset(self, mask=None, seeds=None):
+        # Reset all the machines, or only the ones selected by mask. Each
+        # machine gets an episode seed, drawn from np_random unless given,
+        # and its RND values are then the ones of VM.reset(seed)
+        if mask is None:
+            mask = slice(None)
+        envs = self._envs[mask]
+        if seeds is None:
+            seeds = self.np_random.randint(0, 2**63 - 1, size=len(envs), dtype=np.int64)
+        self.episode_seeds[envs] = seeds
+        self.rng[envs] = [seed_rng(int(seed)) for seed in self.episode_seeds[envs]]
+        self.memory[mask] = self._boot_memory
+        self.display[mask] = 0
+        self.keyboard[mask] = False
+        self.V[mask] = 0
+        self.stack[mask] = 0
+        self.I[mask] = 0
+        self.SP[mask] = 0
+        self.PC[mask] = constants.PROGRAM_OFFSET
+        self.DT[mask] = 0
+        self.ST[mask] = 0
+        self.cycle_index[mask] = 0
+        self._pressed_keys[mask] = NO_ACTION
+
+    def load_rom(self, path):
+        rom = np.fromfile(path, dtype=np.uint8)[:constants.MEMORY_SIZE - constants.PROGRAM_OFFSET]
+
+        offset = constants.PROGRAM_OFFSET
+        self._boot_memory[offset:offset+len(rom)] = rom
+        self.memory[:, offset:offset+len(rom)] = rom
+
+    def load_rom_profile(self, path):
+        # Profiles are parsed once, see RomProfile
+        self.load_profile(load_rom_profile(path))
+
+    def load_profile(self, rom_profile):
+        self._profile = rom_profile.profile
+        self._boot_memory[:] = np.frombuffer(rom_profile.image, dtype=np.uint8)
+        self.memory[:] = self._boot_memory
+
+        self._action_keys = np.array((NO_ACTION,) + tuple(self._profile.get("actions", ())))
+        self._variables = {}
+        for name, variable_profile in self._profile.get("variables", {}).items():
+            vartype = variable_profile["type"]
+            if vartype not in ("mem_bcd", "register"):
+                raise ValueError("Unknown variable type: " + vartype)
+            self._variables[name] = (vartype, variable_profile["index"])
+
+    def get_display_buffer(self):
+        return np.copy(self.display)
+
+    def get_buzzer_state(self):
+        return self.ST > 0
+
+    def get_variable(self, name):
+        # Throw a key error on purpose here if the variable is not defined
+        vartype, index = self._variables[name]
+
+        if vartype == "mem_bcd":
+            digits = self.memory[:, index:index+3].astype(np.int64)
+            return digits[:, 0] * 100 + digits[:, 1] * 10 + digits[:, 2]
+
+        return self.V[:, index].astype(np.int64)
+
+    def get_num_actions(self):
+        # Throw a key error on purpose here if no actions are defined
+        return len(self._profile["actions"]) + 1
+
+    def take_action(self, action_indices):
+        # One action index per machine, pressed for the next cycle
+        self._pressed_keys[:] = self._action_keys[np.asarray(action_indices)]
+
+    def cycle(self):
+        pressed = self._pressed_keys >= 0
+        envs = self._envs[pressed]
+        keys = self._pressed_keys[pressed]
+        self.keyboard[envs, keys] = True
+
+        for _ in range(constants.INSTRUCTIONS_PER_CYCLE):
+            self.step()
+
+        self.DT -= self.DT > 0
+        self.ST -= self.ST > 0
+        self.cycle_index += 1
+
+        # Stop pressing the keys after the frame is over
+        self.keyboard[envs, keys] = False
+        self._pressed_keys[:] = NO_ACTION
+
+    def step(self):
+        mem = self.memory
+        e = self._envs
+        opcode = (mem[e, self.PC & ADDRESS_MASK].astype(np.int64) << 8) | mem[e, (self.PC + 1) & ADDRESS_MASK]
+        self.PC += constants.SZ_INSTR
+
+        n1 = opcode >> 0xC
+        for cls in np.unique(n1):
+            e = np.flatnonzero(n1 == cls)
+            op = opcode[e]
+            self._handlers[cls](self, e, op)
+
+    def _skip(self, e, condition):
+        self.PC[e] += constants.SZ_INSTR * condition
+
+    def _op_0(self, e, op):
+        cls = op == 0x00E0
+        self.display[e[cls]] = 0
+
+        ret = e[op == 0x00EE]
+        self.SP[ret] = (self.SP[ret] - 1) & 0xFF
+        self.PC[ret] = self.stack[ret, self.SP[ret] & 0xF]
+
+    def _op_1(self, e, op):
+        self.PC[e] = op & 0xFFF
+
+    def _op_2(self, e, op):
+        self.stack[e, self.SP[e] & 0xF] = self.PC[e]
+        self.SP[e] = (self.SP[e] + 1) & 0xFF
+        self.PC[e] = op & 0xFFF
+
+    def _op_3(self, e, op):
+        self._skip(e, self.V[e, (op >> 8) & 0xF] == (op & 0xFF))
+
+    def _op_4(self, e, op):
+        self._skip(e, self.V[e, (op >> 8) & 0xF] != (op & 0xFF))
+
+    def _op_5(self, e, op):
+        self._skip(e, self.V[e, (op >> 8) & 0xF] == self.V[e, (op >> 4) & 0xF])
+
+    def _op_6(self, e, op):
+        self.V[e, (op >> 8) & 0xF] = op & 0xFF
+
+    def _op_7(self, e, op):
+        x = (op >> 8) & 0xF
+        self.V[e, x] = (self.V[e, x] + (op & 0xFF)) & 0xFF
+
+    def _op_8(self, e, op):
+        V = self.V
+        x = (op >> 8) & 0xF
+        y = (op >> 4) & 0xF
+        n = op & 0xF
+        for sub in np.unique(n):
+            m = n == sub
+            ee, xx, yy = e[m], x[m], y[m]
+            vx = V[ee, xx].astype(np.int64)
+            vy = V[ee, yy].astype(np.int64)
+            # VF is written before Vx, as in the single machine handlers
+            if sub == 0x0:
+                V[ee, xx] = vy
+            elif sub == 0x1:
+                V[ee, xx] = vx | vy
+            elif sub == 0x2:
+                V[ee, xx] = vx & vy
+            elif sub == 0x3:
+                V[ee, xx] = vx ^ vy
+            elif sub == 0x4:
+                V[ee, 0xF] = (vx + vy) > 0xFF
+                V[ee, xx] = (V[ee, xx].astype(np.int64) + V[ee, yy]) & 0xFF
+            elif sub == 0x5:
+                V[ee, 0xF] = vy <= vx
+                V[ee, xx] = (V[ee, xx].astype(np.int64) - V[ee, yy]) & 0xFF
+            elif sub == 0x6:
+                V[ee, 0xF] = vx & 0x1
+                V[ee, xx] = V[ee, xx] >> 1
+            elif sub == 0x7:
+                V[ee, 0xF] = vx <= vy
+                V[ee, yy] = (V[ee, yy].astype(np.int64) - V[ee, xx]) & 0xFF
+            elif sub == 0xE:
+                V[ee, 0xF] = vx >> 7
+                V[ee, xx] = (V[ee, xx].astype(np.int64) << 1) & 0xFF
+
+    def _op_9(self, e, op):
+        self._skip(e, self.V[e, (op >> 8) & 0xF] != self.V[e, (op >> 4) & 0xF])
+
+    def _op_A(self, e, op):
+        self.I[e] = op & 0xFFF
+
+    def _op_B(self, e, op):
+        self.PC[e] = (self.V[e, 0] + (op & 0xFFF)) & 0xFFFF
+
+    def _op_C(self, e, op):
+        # Same LCG as op_Cxkk, uint64 arrays wrap around
+        rng = self.rng[e] * np.uint64(6364136223846793005) + np.uint64(1442695040888963407)
+        self.rng[e] = rng
+        self.V[e, (op >> 8) & 0xF] = (rng >> np.uint64(56)).astype(np.int64) & op & 0xFF
+
+    def _op_D(self, e, op):
+        vx = self.V[e, (op >> 8) & 0xF].astype(np.int64)
+        vy = self.V[e, (op >> 4) & 0xF].astype(np.int64)
+        n = op & 0xF
+        collision = np.zeros(len(e), dtype=np.bool_)
+        cols = vx[:, np.newaxis] + np.arange(8)
+
+        # Each byte is a row of 8 pixels, rows and columns beyond the screen
+        # limits are clipped
+        for row in range(n.max()):
+            active = (row < n) & (vy + row < constants.SCREEN_ROWS)
+            if not active.any():
+                continue
+            byte = self.memory[e, (self.I[e] + row) & ADDRESS_MASK]
+            pixels = SPRITE_ROWS[byte].astype(np.bool_)
+            pixels &= (cols < constants.SCREEN_COLS) & active[:, np.newaxis]
+
+            envs, bits = np.nonzero(pixels)
+            rows = vy[envs] + row
+            columns = cols[envs, bits]
+            old = self.display[e[envs], rows, columns]
+
+            # A collision occurs when at least one pixel is about to be erased
+            np.logical_or.at(collision, envs, old.astype(np.bool_))
+            self.display[e[envs], rows, columns] = old ^ 1
+
+        self.V[e, 0xF] = collision
+
+    def _op_E(self, e, op):
+        keys = self.V[e, (op >> 8) & 0xF] & 0xF
+        pressed = self.keyboard[e, keys]
+        kk = op & 0xFF
+        self._skip(e, ((kk == 0x9E) & pressed) | ((kk == 0xA1) & ~pressed))
+
+    def _op_F(self, e, op):
+        V = self.V
+        x = (op >> 8) & 0xF
+        kk = op & 0xFF
+        for sub in np.unique(kk):
+            m = kk == sub
+            ee, xx = e[m], x[m]
+            if sub == 0x07:
+                V[ee, xx] = self.DT[ee]
+            elif sub == 0x0A:
+                # PC is not incremented until a key is pressed
+                any_key = self.keyboard[ee].any(axis=1)
+                V[ee[any_key], xx[any_key]] = self.keyboard[ee[any_key]].argmax(axis=1)
+                self.PC[ee[~any_key]] -= constants.SZ_INSTR
+            elif sub == 0x15:
+                self.DT[ee] = V[ee, xx]
+            elif sub == 0x18:
+                self.ST[ee] = V[ee, xx]
+            elif sub == 0x1E:
+                V[ee, 0xF] = (self.I[ee] + V[ee, xx]) > 0xFFFF
+                self.I[ee] = (self.I[ee] + V[ee, xx]) & 0xFFFF
+            elif sub == 0x29:
+                self.I[ee] = constants.FONT_OFFSET + V[ee, xx].astype(np.int64) * constants.FONT_SIZE
+            elif sub == 0x33:
+                value = V[ee, xx]
+                I = self.I[ee]
+                self.memory[ee, I & ADDRESS_MASK] = value // 100
+                self.memory[ee, (I + 1) & ADDRESS_MASK] = (value % 100) // 10
+                self.memory[ee, (I + 2) & ADDRESS_MASK] = value % 10
+            elif sub == 0x55:
+                for i in range(xx.max() + 1):
+                    m = i <= xx
+                    self.memory[ee[m], (self.I[ee[m]] + i) & ADDRESS_MASK] = V[ee[m], i]
+            elif sub == 0x65:
+                for i in range(xx.max() + 1):
+                    m = i <= xx
+                    V[ee[m], i] = self.memory[ee[m], (self.I[ee[m]] + i) & ADDRESS_MASK]
+
+    _handlers = (
+        _op_0, _op_1, _op_2, _op_3, _op_4, _op_5, _op_6, _op_7,
+        _op_8, _op_9, _op_A, _op_B, _op_C, _op_D, _op_E, _op_F,
+    )
@@ -1,8 +1,49 @@
+from functools import partial
+
 from . import utils
 from . import state
 from . import opcodes
+from .jit import BlockCache
+from .profiler import Profiler
 from .constants import SZ_INSTR
 
+NUM_OPCODES = 0x10000
+
+OPERAND_DECODERS = {
+    'x': opcodes.x,
+    'y': opcodes.y,
+    'n': opcodes.n,
+    'kk': opcodes.kk,
+    'nnn': opcodes.nnn,
+}
+
+# Dispatch tables and their opcode maps, shared by every unhooked
+# OpcodeTable loaded from the same module
+_shared_tables = {}
+
+# Handlers and operand names of the modules already loaded, a new CPU is
+# created on every reset
+_loaded_modules = {}
+
+
+def get_operand_names(key):
+    # The operands of a handler are spelled out in its key, e.g. 'Dxyn'
+    names = []
+    i = 0
+    while i < len(key):
+        if key.startswith('nnn', i):
+            names.append('nnn')
+            i += 3
+        elif key.startswith('kk', i):
+            names.append('kk')
+            i += 2
+        elif key[i] in OPERAND_DECODERS:
+            names.append(key[i])
+            i += 1
+        else:
+            i += 1
+    return tuple(names)
+
 
 class OpcodeTable(object):
     __metaclass__ = utils.Singleton
@@ -13,17 +54,38 @@ class OpcodeTable(object):
     def __init__(self, opmodule):
         self.opcodes = dict()
         self.hooked = dict()
-        self.opmap = dict()
+        self._unhooked = dict()
+        self._operand_names = dict()
         self.load_module(opmodule)
 
+        # Flat table indexed by the 16-bit opcode holding handlers with their
+        # operands already bound, filled in lazily by bind(). Unhooked tables
+        # share it until the first hook is installed.
+        if opmodule.__name__ not in _shared_tables:
+            _shared_tables[opmodule.__name__] = ([None] * NUM_OPCODES, dict())
+        self.dispatch, self.opmap = _shared_tables[opmodule.__name__]
+        self._shared = True
+        # Bumped whenever bound handlers change, so callers caching them can
+        # tell when to drop their copies
+        self.version = 0
+
     def load_module(self, opmod):
         #path = os.path.basename(opmod).strip('.py')
         #opmod = importlib.import_module('.%s' % path, 'core')
-        for key in opmod.__dict__:
-            if key.startswith('op_'):
-                opcode = key[3:]
-                method = opmod.__dict__[key]
-                self.opcodes[opcode] = method
+        if opmod not in _loaded_modules:
+            handlers = dict()
+            operand_names = dict()
+            for key in opmod.__dict__:
+                if key.startswith('op_'):
+                    opcode = key[3:]
+                    handlers[opcode] = opmod.__dict__[key]
+                    operand_names[opcode] = get_operand_names(opcode)
+            _loaded_modules[opmod] = handlers, operand_names
+
+        handlers, operand_names = _loaded_modules[opmod]
+        self.opcodes.update(handlers)
+        self._unhooked.update(handlers)
+        self._operand_names.update(operand_names)
 
     def get_opcode_key(self, opcode):
         n1 = opcode >> 0xC
@@ -63,17 +125,58 @@ class OpcodeTable(object):
 
         raise KeyError('Invalid OpCode: 0x%X' % opcode)
 
+    def get_operands(self, key, opcode):
+        return tuple(OPERAND_DECODERS[name](opcode) for name in self._operand_names[key])
+
+    def bind(self, opcode):
+        key = self.get_opcode_key(opcode)
+        handler = self.opcodes[key]
+
+        # Module handlers get their operands prebound, hooks only take the state
+        if handler is self._unhooked[key]:
+            operands = self.get_operands(key, opcode)
+            if operands:
+                handler = partial(handler, *operands)
+
+        self.dispatch[opcode] = handler
+        self.opmap.setdefault(key, set()).add(opcode)
+        return handler
+
+    def invalidate(self, key):
+        if self._shared:
+            # Copy the shared table so other CPUs are not affected by our hooks
+            self.dispatch = list(self.dispatch)
+            self.opmap = dict((k, set(v)) for k, v in self.opmap.items())
+            self._shared = False
+
+        for opcode in self.opmap.pop(key, ()):
+            self.dispatch[opcode] = None
+        self.version += 1
+
+    def get_state_handler(self, key):
+        # Return a handler for key that can be called with the state only
+        handler = self.opcodes[key]
+        if handler is not self._unhooked[key]:
+            return handler
+
+        def handle(state):
+            handler(*self.get_operands(key, state.current), state)
+
+        return handle
+
     def hook(self, key, handler):
         original = self.opcodes[key]
         self.hooked[key] = original
         self.opcodes[key] = handler
+        self.invalidate(key)
 
     def unhook(self, key):
         self.opcodes[key] = self.hooked[key]
         del self.hooked[key]
+        self.invalidate(key)
 
     def pre_hook(self, key, handler):
-        original = self.opcodes[key]
+        original = self.get_state_handler(key)
 
         def handle(state):
             handler(state)
@@ -82,7 +185,7 @@ class OpcodeTable(object):
         self.hook(key, handle)
 
     def post_hook(self, key, handler):
-        original = self.opcodes[key]
+        original = self.get_state_handler(key)
 
         def handle(state):
             original(state)
@@ -92,7 +195,7 @@ class OpcodeTable(object):
 
     def __getitem__(self, key):
         key = self.get_opcode_key(key)
-        return self.opcodes[key]
+        return self.get_state_handler(key)
 
     def __setitem__(self, key, value):
         self.hook(key, value)
@@ -100,7 +203,7 @@ class OpcodeTable(object):
     def __delitem__(self, opcode):
         key = self.get_opcode_key(opcode)
         if key in self.hooked:
-            self.unhook(opcode)
+            self.unhook(key)
 
     def __call__(self, key, *args, **kwargs):
         return self.__getitem__(key)
@@ -110,18 +213,28 @@ class CPU(object):
     state = None
     optable = None
 
-    def __init__(self, current=None):
-        self.optable = OpcodeTable(opcodes)
+    MODES = ('interpreter', 'jit')
+
+    def __init__(self, current=None, mode='interpreter', optable=None):
+        self.optable = optable if optable is not None else OpcodeTable(opcodes)
 
         if current is not None:
             self.state = current
         else:
             self.state = state.State()
 
+        # In 'jit' mode, run() executes cached basic blocks instead of
+        # decoding one instruction at a time
+        if mode not in self.MODES:
+            raise ValueError('Unknown CPU mode: %s' % mode)
+        self.mode = mode
+        self._blocks = BlockCache(self) if mode == 'jit' else None
+        self.profiler = None
+
     def fetch_instruction(self):
         # Reverse MSB order
-        msb = self.state.memory[self.state.PC] << 8
-        lsb = self.state.memory[self.state.PC + 1]
+        msb = int(self.state.memory[self.state.PC]) << 8
+        lsb = int(self.state.memory[self.state.PC + 1])
 
         # Increase the program counter
         self.state.PC += SZ_INSTR
@@ -129,8 +242,50 @@ class CPU(object):
         return msb + lsb
 
     def step(self):
-        self.state.current = self.fetch_instruction()
+        opcode = self.fetch_instruction()
+        self.state.current = opcode
         try:
-            self.optable[self.state.current](self.state)
+            handler = self.optable.dispatch[opcode] or self.optable.bind(opcode)
+            handler(self.state)
         except KeyError as ex:
             print('[!] ERROR: unknown opcode: %s' % str(ex))
+
+    def run(self, count):
+        # Execute count instructions
+        if self._blocks is not None:
+            self._blocks.run(count)
+        else:
+            for _ in range(count):
+                self.step()
+
+    def enable_profiling(self, profiler=None):
+        # Profiling swaps in instrumented step and run methods on this
+        # instance, so it costs nothing while disabled. Blocks are not
+        # compiled while profiling, every instruction is counted.
+        if profiler is None:
+            profiler = Profiler(self.optable.get_opcode_key)
+        self.profiler = profiler
+        self.step = self._profiled_step
+        self.run = self._profiled_run
+        return profiler
+
+    def disable_profiling(self):
+        # The profiler is kept around to read its counters
+        self.__dict__.pop('step', None)
+        self.__dict__.pop('run', None)
+        # Instructions run while profiling may have written over blocks
+        self.invalidate_cache()
+
+    def _profiled_step(self):
+        st = self.state
+        self.profiler.record(st.PC, (st.memory[st.PC] << 8) | st.memory[st.PC + 1])
+        CPU.step(self)
+
+    def _profiled_run(self, count):
+        for _ in range(count):
+            self._profiled_step()
+
+    def invalidate_cache(self):
+        # Must be called after memory is written outside of the opcode handlers
+        if self._blocks is not None:
+            self._blocks.invalidate()
@@ -1,20 +1,65 @@
+import struct
 import numpy as np
 from . import constants
 
+# Pixel rows for every possible sprite byte
+SPRITE_ROWS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1)
+
+ROW_MASK = (1 << constants.SCREEN_COLS) - 1
+PACKED_ROWS = struct.Struct('>%dQ' % constants.SCREEN_ROWS)
+
 
 class Display():
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, wrap=False, **kwargs):
+        # Sprites are clipped at the screen edges unless wrap is set,
+        # in which case they wrap around to the opposite edge
+        self.wrap = wrap
         self._buffer_has_changed = False
 
+        # Bumped by every change, each row keeps the version it was last
+        # changed in so that readers can tell which rows they have to update
+        self.version = 0
+        self.row_versions = [0] * constants.SCREEN_ROWS
+
         shape = constants.SCREEN_ROWS, constants.SCREEN_COLS
         self.buffer = np.zeros(shape, *args, dtype=np.uint8, **kwargs)
 
+    def get_dirty_rows(self, since):
+        # (start, end) range of the rows changed after version since,
+        # empty if none were
+        version = self.version
+        if since >= version:
+            return 0, 0
+        dirty = [row for row, row_version in enumerate(self.row_versions) if row_version > since]
+        if not dirty:
+            return 0, 0
+        return dirty[0], dirty[-1] + 1
+
+    def _touch_rows(self, mask):
+        # Mark the rows set in the bit mask as changed
+        self.version += 1
+        while mask:
+            row = mask.bit_length() - 1
+            self.row_versions[row] = self.version
+            mask ^= 1 << row
+
+    def _touch_all_rows(self):
+        self.version += 1
+        self.row_versions[:] = [self.version] * constants.SCREEN_ROWS
+
     def clear(self):
         self._buffer_has_changed = np.any(self.buffer)
+        if self._buffer_has_changed:
+            self._touch_all_rows()
         self.buffer.fill(0)
 
     def draw_sprite(self, x, y, sprite):
+        self.version += 1
+        if self.wrap:
+            return self._draw_wrapped_sprite(x, y, sprite)
+
         self._buffer_has_changed = True
+        row_versions = self.row_versions
 
         collision = False
         # Each byte is a row of 8 pixels
@@ -27,22 +72,56 @@ class Display():
             if x >= constants.SCREEN_COLS:
                 continue
 
+            row_versions[y+row] = self.version
             xmax = min(x + 8, constants.SCREEN_COLS)
             numcols = xmax - x
-            mask = np.unpackbits(byte)[:numcols]
+            mask = SPRITE_ROWS[byte][:numcols]
 
             old_pixel_row = self.buffer[y+row][x:xmax]
             # A collision occurs when at least one pixel is about to be erased
-            collision |= np.any(np.bitwise_and(old_pixel_row, mask))
+            collision |= bool(np.any(np.bitwise_and(old_pixel_row, mask)))
 
             # XOR each pixel of the sprite row with the buffer
             self.buffer[y+row][x:xmax] = np.bitwise_xor(old_pixel_row, mask)
 
             # A change occures when at least one pixel is flipped
-            self._buffer_has_changed |= (self.buffer[y+row][x:xmax] != old_pixel_row).any()
+            self._buffer_has_changed |= bool((self.buffer[y+row][x:xmax] != old_pixel_row).any())
 
         return collision
 
+    def _draw_wrapped_sprite(self, x, y, sprite):
+        self._buffer_has_changed = True
+
+        collision = False
+        cols = (x + np.arange(8)) % constants.SCREEN_COLS
+        for row, byte in enumerate(sprite):
+            index = (y + row) % constants.SCREEN_ROWS
+            self.row_versions[index] = self.version
+            pixel_row = self.buffer[index]
+            mask = SPRITE_ROWS[byte]
+            collision |= bool(np.any(np.bitwise_and(pixel_row[cols], mask)))
+            pixel_row[cols] ^= mask
+
+        return collision
+
+    def dumps(self):
+        return self.buffer.tobytes()
+
+    def load(self, data):
+        self._touch_all_rows()
+        self.buffer[:] = np.frombuffer(data, dtype=np.uint8).reshape(self.buffer.shape)
+
+    def _copy_versions(self, display):
+        display.version = self.version
+        display.row_versions[:] = self.row_versions
+
+    def copy(self):
+        display = Display(wrap=self.wrap)
+        display._buffer_has_changed = self._buffer_has_changed
+        self._copy_versions(display)
+        display.buffer[:] = self.buffer
+        return display
+
     def __repr__(self):
         result = ""
         result += '.' + constants.SCREEN_COLS * '-' + '.\n'
@@ -53,3 +132,90 @@ class Display():
             result += '|\n'
         result += "'" + constants.SCREEN_COLS * '-' + "'\n"
         return result
+
+
+class PackedDisplay(Display):
+    '''Display storing each row of pixels as one 64-bit integer.
+
+    Column 0 is the most significant bit of a row. Drawing a sprite row is a
+    single shift, AND (collision) and XOR. The (32, 64) uint8 buffer is only
+    expanded when it is read.
+    '''
+
+    def __init__(self, wrap=False):
+        self.wrap = wrap
+        self._buffer_has_changed = False
+        self.version = 0
+        self.row_versions = [0] * constants.SCREEN_ROWS
+
+        self.rows = [0] * constants.SCREEN_ROWS
+        shape = constants.SCREEN_ROWS, constants.SCREEN_COLS
+        self._buffer = np.zeros(shape, dtype=np.uint8)
+        self._buffer_is_stale = False
+
+    @property
+    def buffer(self):
+        if self._buffer_is_stale:
+            words = np.array(self.rows, dtype='>u8')
+            self._buffer[:] = np.unpackbits(words.view(np.uint8)).reshape(self._buffer.shape)
+            self._buffer_is_stale = False
+        return self._buffer
+
+    def dumps(self):
+        return PACKED_ROWS.pack(*self.rows)
+
+    def load(self, data):
+        self._touch_all_rows()
+        self.rows[:] = PACKED_ROWS.unpack_from(data)
+        self._buffer_is_stale = True
+
+    def copy(self):
+        display = PackedDisplay(wrap=self.wrap)
+        display._buffer_has_changed = self._buffer_has_changed
+        self._copy_versions(display)
+        display.rows[:] = self.rows
+        display._buffer_is_stale = True
+        return display
+
+    def clear(self):
+        self._buffer_has_changed = any(self.rows)
+        if self._buffer_has_changed:
+            self._touch_all_rows()
+        self.rows[:] = [0] * constants.SCREEN_ROWS
+        self._buffer_is_stale = True
+
+    def draw_sprite(self, x, y, sprite):
+        self._buffer_has_changed = True
+        self._buffer_is_stale = True
+        self.version += 1
+        version = self.version
+        row_versions = self.row_versions
+
+        rows = self.rows
+        wrap = self.wrap
+        if wrap:
+            x %= constants.SCREEN_COLS
+
+        collision = False
+        for row, byte in enumerate(sprite):
+            index = y + row
+            if index >= constants.SCREEN_ROWS:
+                if not wrap:
+                    break
+                index %= constants.SCREEN_ROWS
+
+            # Shift the sprite byte to its column, bits beyond the right
+            # edge are either dropped or rotated back to the left edge
+            word = byte << (constants.SCREEN_COLS - 8)
+            if wrap:
+                word = ((word >> x) | (word << (constants.SCREEN_COLS - x))) & ROW_MASK
+            else:
+                word >>= x
+
+            row_versions[index] = version
+            old = rows[index]
+            if old & word:
+                collision = True
+            rows[index] = old ^ word
+
+        return collision
@@ -0,0 +1,130 @@
+from . import constants
+from . import opcodes
+
+# Longest run of instructions compiled into a single block
+MAX_BLOCK_LENGTH = 32
+
+# Instructions that read or change the PC end a block
+BRANCHES = frozenset((
+    '00EE', '1nnn', '2nnn', 'Bnnn',
+    '3xkk', '4xkk', '5xy0', '9xy0',
+    'Ex9E', 'ExA1', 'Fx0A',
+))
+
+# Instructions that write memory end a block, so that the blocks they
+# overwrite are dropped before running again
+STORES = frozenset(('Fx33', 'Fx55'))
+
+
+def get_store_size(key, opcode):
+    if key == 'Fx33':
+        return 3
+    return opcodes.x(opcode) + 1
+
+
+class BlockCache(object):
+    '''Runs straight-line runs of instructions as compiled Python functions.
+
+    A block starts at a PC and ends after a branch, a memory store, or
+    MAX_BLOCK_LENGTH instructions. Its handlers are the CPU dispatch table
+    entries, called in sequence by code generated with compile(). Blocks are
+    keyed by their start address and instruction budget, so a cycle never
+    runs more instructions than the interpreter would.
+    '''
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.invalidate()
+
+    def invalidate(self):
+        self._blocks = dict()
+        # Number of cached blocks covering each address
+        self._code_map = [0] * constants.MEMORY_SIZE
+        self._optable_version = self.cpu.optable.version
+
+    def invalidate_range(self, start, end):
+        # Drop every block covering an address in [start, end)
+        for key, block in list(self._blocks.items()):
+            block_start, block_end = block[3], block[4]
+            if block_start < end and start < block_end:
+                del self._blocks[key]
+                for address in range(block_start, block_end):
+                    self._code_map[address] -= 1
+
+    def compile(self, pc, limit):
+        optable = self.cpu.optable
+        memory = self.cpu.state.memory
+
+        namespace = dict()
+        lines = []
+        length = 0
+        address = pc
+        store_size = 0
+        ends_with_branch = False
+        last_opcode = None
+        while length < limit and address + 1 < constants.MEMORY_SIZE:
+            opcode = (memory[address] << 8) | memory[address + 1]
+            try:
+                handler = optable.dispatch[opcode] or optable.bind(opcode)
+            except KeyError:
+                break
+            key = optable.get_opcode_key(opcode)
+            address += constants.SZ_INSTR
+            last_opcode = opcode
+
+            name = 'h%d' % length
+            namespace[name] = handler
+            length += 1
+            # Hooks may read the current opcode and PC, the bound handlers don't
+            if key in optable.hooked:
+                lines.append('st.current = 0x%04X' % opcode)
+                lines.append('st.PC = 0x%04X' % address)
+            if key in BRANCHES or key in STORES:
+                lines.append('st.PC = 0x%04X' % address)
+                lines.append('%s(st)' % name)
+                ends_with_branch = True
+                if key in STORES:
+                    store_size = get_store_size(key, opcode)
+                break
+            lines.append('%s(st)' % name)
+
+        if not length:
+            return None
+        # After the block, the current opcode is its last one, as in the
+        # interpreter. Set before the last call, the handlers don't read it.
+        last_call = max(index for index, line in enumerate(lines) if line.endswith('(st)'))
+        lines.insert(last_call, 'st.current = 0x%04X' % last_opcode)
+        if not ends_with_branch:
+            lines.append('st.PC = 0x%04X' % address)
+
+        source = 'def block(st):\n    ' + '\n    '.join(lines) + '\n'
+        exec(compile(source, '<block 0x%03X>' % pc, 'exec'), namespace)
+
+        block = (namespace['block'], length, store_size, pc, address)
+        self._blocks[(pc << 6) | limit] = block
+        for covered in range(pc, address):
+            self._code_map[covered] += 1
+        return block
+
+    def run(self, count):
+        cpu = self.cpu
+        st = cpu.state
+        if self._optable_version != cpu.optable.version:
+            self.invalidate()
+
+        blocks = self._blocks
+        code_map = self._code_map
+        while count > 0:
+            limit = count if count < MAX_BLOCK_LENGTH else MAX_BLOCK_LENGTH
+            block = blocks.get((st.PC << 6) | limit) or self.compile(st.PC, limit)
+            if block is None:
+                # Let the interpreter report the invalid opcode
+                cpu.step()
+                count -= 1
+                continue
+
+            run_block, length, store_size = block[:3]
+            run_block(st)
+            count -= length
+            if store_size and any(code_map[st.I:st.I + store_size]):
+                self.invalidate_range(st.I, st.I + store_size)
@@ -0,0 +1,291 @@
+import numpy as np
+
+from . import constants
+from .state import V_OFFSET, KEYBOARD_OFFSET, STACK_OFFSET, REGISTERS_OFFSET, MEMORY_OFFSET
+
+# numba is optional, without it VMPool steps every VM with VM.cycle
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Offsets of the fields of state.REGISTERS in the state buffer
+I_OFFSET = REGISTERS_OFFSET
+PC_OFFSET = REGISTERS_OFFSET + 2
+SP_OFFSET = REGISTERS_OFFSET + 4
+DT_OFFSET = REGISTERS_OFFSET + 5
+ST_OFFSET = REGISTERS_OFFSET + 6
+CURRENT_OFFSET = REGISTERS_OFFSET + 7
+CYCLE_OFFSET = REGISTERS_OFFSET + 9
+RNG_OFFSET = REGISTERS_OFFSET + 17
+OUTPUT_CHANGED_OFFSET = REGISTERS_OFFSET + 25
+BUFFER_CHANGED_OFFSET = REGISTERS_OFFSET + 26
+
+ALL_ROWS = (1 << constants.SCREEN_ROWS) - 1
+
+# Columns of the status array filled in by run_cycles
+EXECUTED = 0
+DIRTY_ROWS = 1
+STORED = 2
+
+
+def _read(blob, offset, size):
+    value = np.uint64(0)
+    for i in range(size):
+        value |= np.uint64(blob[offset + i]) << np.uint64(8 * i)
+    return value
+
+
+def _write(blob, offset, size, value):
+    value = np.uint64(value)
+    for i in range(size):
+        blob[offset + i] = np.uint8((value >> np.uint64(8 * i)) & np.uint64(0xFF))
+
+
+def _run_cycle(blob, display, wrap, count):
+    '''Run a cycle of count instructions, then the timers, on a state buffer.
+
+    The handlers of opcodes.py are mirrored on the state buffer, with the
+    registers packed into it, and a Display buffer. Instructions that would
+    raise or print in the interpreter (invalid opcodes, addresses out of
+    memory, stack overflows) stop the cycle before they run, so that the
+    interpreter can run them and the rest of the cycle.
+
+    Returns the number of instructions run, the bit mask of the display rows
+    drawn and whether memory was written.
+    '''
+    memory_size = constants.MEMORY_SIZE
+    rows = constants.SCREEN_ROWS
+    cols = constants.SCREEN_COLS
+    V = V_OFFSET
+    K = KEYBOARD_OFFSET
+    M = MEMORY_OFFSET
+
+    I = np.int64(_read(blob, I_OFFSET, 2))
+    PC = np.int64(_read(blob, PC_OFFSET, 2))
+    SP = np.int64(blob[SP_OFFSET])
+    DT = np.int64(blob[DT_OFFSET])
+    ST = np.int64(blob[ST_OFFSET])
+    current = np.int64(_read(blob, CURRENT_OFFSET, 2))
+    rng = _read(blob, RNG_OFFSET, 8)
+    output_changed = blob[OUTPUT_CHANGED_OFFSET] != 0
+    buffer_changed = blob[BUFFER_CHANGED_OFFSET] != 0
+    dirty = np.int64(0)
+    stored = False
+
+    executed = 0
+    while executed < count:
+        if PC + 1 >= memory_size:
+            break
+        opcode = (np.int64(blob[M + PC]) << 8) | np.int64(blob[M + PC + 1])
+        n1 = opcode >> 12
+        x = (opcode >> 8) & 0xF
+        y = (opcode >> 4) & 0xF
+        n = opcode & 0xF
+        kk = opcode & 0xFF
+        nnn = opcode & 0xFFF
+        vx = np.int64(blob[V + x])
+        vy = np.int64(blob[V + y])
+        next_pc = PC + 2
+
+        if n1 == 0x0:
+            if x != 0:
+                # SYS addr
+                pass
+            elif n == 0x0:
+                # CLS
+                buffer_changed = False
+                for row in range(rows):
+                    for col in range(cols):
+                        if display[row, col]:
+                            buffer_changed = True
+                            display[row, col] = 0
+                if buffer_changed:
+                    dirty = ALL_ROWS
+            elif n == 0xE:
+                # RET
+                sp = (SP - 1) & 0xFF
+                if sp >= 16:
+                    break
+                SP = sp
+                next_pc = np.int64(_read(blob, STACK_OFFSET + 2 * SP, 2))
+            else:
+                break
+        elif n1 == 0x1:
+            next_pc = nnn
+        elif n1 == 0x2:
+            if SP >= 16:
+                break
+            _write(blob, STACK_OFFSET + 2 * SP, 2, next_pc)
+            SP = (SP + 1) & 0xFF
+            next_pc = nnn
+        elif n1 == 0x3:
+            if vx == kk:
+                next_pc += 2
+        elif n1 == 0x4:
+            if vx != kk:
+                next_pc += 2
+        elif n1 == 0x5:
+            if vx == vy:
+                next_pc += 2
+        elif n1 == 0x6:
+            blob[V + x] = kk
+        elif n1 == 0x7:
+            blob[V + x] = (vx + kk) & 0xFF
+        elif n1 == 0x8:
+            # VF is written first, later reads see it as the handlers do
+            if n == 0x0:
+                blob[V + x] = vy
+            elif n == 0x1:
+                blob[V + x] = vx | vy
+            elif n == 0x2:
+                blob[V + x] = vx & vy
+            elif n == 0x3:
+                blob[V + x] = vx ^ vy
+            elif n == 0x4:
+                blob[V + 0xF] = (vx + vy) > 0xFF
+                blob[V + x] = (np.int64(blob[V + x]) + np.int64(blob[V + y])) & 0xFF
+            elif n == 0x5:
+                blob[V + 0xF] = vy <= vx
+                blob[V + x] = (np.int64(blob[V + x]) - np.int64(blob[V + y])) & 0xFF
+            elif n == 0x6:
+                blob[V + 0xF] = vx & 0x1
+                blob[V + x] = np.int64(blob[V + x]) >> 1
+            elif n == 0x7:
+                blob[V + 0xF] = vx <= vy
+                blob[V + y] = (np.int64(blob[V + y]) - np.int64(blob[V + x])) & 0xFF
+            elif n == 0xE:
+                blob[V + 0xF] = vx >> 7
+                blob[V + x] = (np.int64(blob[V + x]) << 1) & 0xFF
+            else:
+                break
+        elif n1 == 0x9:
+            if vx != vy:
+                next_pc += 2
+        elif n1 == 0xA:
+            I = nnn
+        elif n1 == 0xB:
+            next_pc = (np.int64(blob[V]) + nnn) & 0xFFFF
+        elif n1 == 0xC:
+            rng = rng * np.uint64(6364136223846793005) + np.uint64(1442695040888963407)
+            blob[V + x] = np.int64(rng >> np.uint64(56)) & kk
+        elif n1 == 0xD:
+            if I + n > memory_size:
+                break
+            buffer_changed = True
+            collision = 0
+            for row in range(n):
+                byte = np.int64(blob[M + I + row])
+                if wrap:
+                    index = (vy + row) % rows
+                    dirty |= np.int64(1) << index
+                    for bit in range(8):
+                        col = (vx + bit) % cols
+                        pixel = (byte >> (7 - bit)) & 1
+                        old = np.int64(display[index, col])
+                        collision |= old & pixel
+                        display[index, col] = old ^ pixel
+                else:
+                    index = vy + row
+                    if index >= rows or vx >= cols:
+                        continue
+                    dirty |= np.int64(1) << index
+                    for bit in range(min(8, cols - vx)):
+                        pixel = (byte >> (7 - bit)) & 1
+                        old = np.int64(display[index, vx + bit])
+                        collision |= old & pixel
+                        display[index, vx + bit] = old ^ pixel
+            blob[V + 0xF] = collision
+        elif n1 == 0xE:
+            if n != 0xE and n != 0x1:
+                break
+            if vx >= 16:
+                break
+            pressed = blob[K + vx] != 0
+            if pressed == (n == 0xE):
+                next_pc += 2
+        else:
+            if kk == 0x07:
+                blob[V + x] = DT
+            elif kk == 0x0A:
+                next_pc -= 2
+                for key in range(16):
+                    if blob[K + key]:
+                        blob[V + x] = key
+                        next_pc += 2
+                        break
+            elif kk == 0x15:
+                DT = vx
+            elif kk == 0x18:
+                output_changed |= (ST != 0) != (vx != 0)
+                ST = vx
+            elif kk == 0x1E:
+                blob[V + 0xF] = (I + vx) > 0xFFFF
+                I = (I + np.int64(blob[V + x])) & 0xFFFF
+            elif kk == 0x29:
+                I = constants.FONT_OFFSET + vx * constants.FONT_SIZE
+            elif kk == 0x33:
+                if I + 2 >= memory_size:
+                    break
+                blob[M + I] = vx // 100
+                blob[M + I + 1] = (vx % 100) // 10
+                blob[M + I + 2] = vx % 10
+                stored = True
+            elif kk == 0x55:
+                if I + x >= memory_size:
+                    break
+                for i in range(x + 1):
+                    blob[M + I + i] = blob[V + i]
+                stored = True
+            elif kk == 0x65:
+                if I + x >= memory_size:
+                    break
+                for i in range(x + 1):
+                    blob[V + i] = blob[M + I + i]
+            else:
+                break
+
+        current = opcode
+        PC = next_pc
+        executed += 1
+
+    cycle = _read(blob, CYCLE_OFFSET, 8)
+    if executed == count:
+        if DT > 0:
+            DT -= 1
+        if ST > 0:
+            ST -= 1
+            output_changed |= ST == 0
+        cycle += np.uint64(1)
+
+    _write(blob, I_OFFSET, 2, I)
+    _write(blob, PC_OFFSET, 2, PC)
+    blob[SP_OFFSET] = SP
+    blob[DT_OFFSET] = DT
+    blob[ST_OFFSET] = ST
+    _write(blob, CURRENT_OFFSET, 2, current)
+    _write(blob, CYCLE_OFFSET, 8, cycle)
+    _write(blob, RNG_OFFSET, 8, rng)
+    blob[OUTPUT_CHANGED_OFFSET] = output_changed
+    blob[BUFFER_CHANGED_OFFSET] = buffer_changed
+    return executed, dirty, stored
+
+
+def _run_cycles(blobs, displays, wraps, indices, count, status):
+    # Run a cycle on each of the selected machines
+    for index in indices:
+        executed, dirty, stored = _run_cycle(blobs[index], displays[index], wraps[index], count)
+        status[index, EXECUTED] = executed
+        status[index, DIRTY_ROWS] = dirty
+        status[index, STORED] = stored
+
+
+if numba is not None:
+    # Compiled without the GIL, so that threads run cycles in parallel
+    jit = numba.njit(nogil=True, cache=True)
+    _read = jit(_read)
+    _write = jit(_write)
+    _run_cycle = jit(_run_cycle)
+    run_cycles = jit(_run_cycles)
+else:
+    run_cycles = None
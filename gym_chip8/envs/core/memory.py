@@ -0,0 +1,66 @@
+from . import constants
+
+PAGE_BITS = 8
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+NUM_PAGES = constants.MEMORY_SIZE // PAGE_SIZE
+
+ZERO_PAGE = bytes(PAGE_SIZE)
+
+
+class PagedMemory(object):
+    '''CHIP-8 memory split into pages shared copy-on-write between forks.
+
+    Shared pages are immutable bytes objects. A page is copied into a private
+    bytearray the first time it is written, so forked memories only grow with
+    the number of pages they dirty.
+    '''
+    __slots__ = ('pages',)
+
+    def __init__(self, pages=None):
+        self.pages = pages if pages is not None else [ZERO_PAGE] * NUM_PAGES
+
+    def fork(self):
+        # Freeze our private pages, both memories then share all of them
+        pages = self.pages
+        for index, page in enumerate(pages):
+            if type(page) is bytearray:
+                pages[index] = bytes(page)
+        return PagedMemory(list(pages))
+
+    def load(self, data):
+        self.pages = [bytes(data[start:start+PAGE_SIZE]) for start in range(0, constants.MEMORY_SIZE, PAGE_SIZE)]
+
+    def count_private_pages(self):
+        return sum(type(page) is bytearray for page in self.pages)
+
+    def __len__(self):
+        return constants.MEMORY_SIZE
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+    def __bytes__(self):
+        return b''.join(self.pages)
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            start, stop, step = index.indices(constants.MEMORY_SIZE)
+            if step == 1 and start < stop and start >> PAGE_BITS == (stop - 1) >> PAGE_BITS:
+                # Fast path for reads within a single page, e.g. sprites
+                offset = start & PAGE_MASK
+                return bytes(self.pages[start >> PAGE_BITS][offset:offset + stop - start])
+            return bytes(self)[index]
+        return self.pages[index >> PAGE_BITS][index & PAGE_MASK]
+
+    def __setitem__(self, index, value):
+        if type(index) is slice:
+            for address, byte in zip(range(*index.indices(constants.MEMORY_SIZE)), value):
+                self[address] = byte
+            return
+
+        page = self.pages[index >> PAGE_BITS]
+        if type(page) is not bytearray:
+            page = self.pages[index >> PAGE_BITS] = bytearray(page)
+        page[index & PAGE_MASK] = value
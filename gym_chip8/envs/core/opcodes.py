@@ -1,10 +1,9 @@
-import numpy as np
-import random
 from . import constants
 
 SZ_INSTR = constants.SZ_INSTR
 
-
+# Operand decoders. Handlers receive their decoded operands first and the
+# state last, so the CPU dispatch table can prebind the operands once.
 def n1(i):
     return i >> 0xC
 
@@ -36,248 +35,202 @@ def op_00E0(st):
 
 def op_00EE(st):
     '''RET'''
-    st.SP -= 1
+    st.SP = (st.SP - 1) & 0xFF
     st.PC = st.stack[st.SP]
 
 
-def op_0nnn(st):
+def op_0nnn(nnn, st):
     '''SYS addr'''
     # ignore
     pass
 
 
-def op_1nnn(st):
+def op_1nnn(nnn, st):
     '''JP addr'''
-    c = st.current
-    st.PC = nnn(c)
+    st.PC = nnn
 
 
-def op_2nnn(st):
+def op_2nnn(nnn, st):
     # CALL nnn
-    c = st.current
     st.stack[st.SP] = st.PC
-    st.SP += 1
-    st.PC = nnn(c)
+    st.SP = (st.SP + 1) & 0xFF
+    st.PC = nnn
 
 
-def op_3xkk(st):
+def op_3xkk(x, kk, st):
     # SE Vx, kk
-    c = st.current
-    if np.equal(st.V[x(c)], kk(c)):
+    if st.V[x] == kk:
         st.PC += SZ_INSTR
 
 
-def op_4xkk(st):
+def op_4xkk(x, kk, st):
     # SNE Vx, kk
-    c = st.current
-    if np.not_equal(st.V[x(c)], kk(c)):
+    if st.V[x] != kk:
         st.PC += SZ_INSTR
 
 
-def op_5xy0(st):
+def op_5xy0(x, y, st):
     # SE Vx, Vy
-    c = st.current
-    if np.equal(st.V[x(c)], st.V[y(c)]):
+    if st.V[x] == st.V[y]:
         st.PC += SZ_INSTR
 
 
-def op_6xkk(st):
+def op_6xkk(x, kk, st):
     # LD Vx, kk
-    c = st.current
-    st.V[x(c)] = kk(c)
+    st.V[x] = kk
 
 
-def op_7xkk(st):
+def op_7xkk(x, kk, st):
     # ADD Vx, kk
-    c = st.current
-    st.V[x(c)] = np.add(st.V[x(c)], kk(c))
+    st.V[x] = (st.V[x] + kk) & 0xFF
 
 
-def op_8xy0(st):
+def op_8xy0(x, y, st):
     # LD Vx, Vy
-    c = st.current
-    st.V[x(c)] = st.V[y(c)]
+    st.V[x] = st.V[y]
 
 
-def op_8xy1(st):
+def op_8xy1(x, y, st):
     # OR Vx, Vy
-    c = st.current
-    st.V[x(c)] = np.bitwise_or(st.V[x(c)], st.V[y(c)])
+    st.V[x] |= st.V[y]
 
 
-def op_8xy2(st):
+def op_8xy2(x, y, st):
     # AND Vx, Vy
-    c = st.current
-    st.V[x(c)] = np.bitwise_and(st.V[x(c)], st.V[y(c)])
+    st.V[x] &= st.V[y]
 
 
-def op_8xy3(st):
+def op_8xy3(x, y, st):
     # XOR Vx, Vy
-    c = st.current
-    st.V[x(c)] = np.bitwise_xor(st.V[x(c)], st.V[y(c)])
+    st.V[x] ^= st.V[y]
 
 
-def op_8xy4(st):
+def op_8xy4(x, y, st):
     # ADD Vx, Vy
-    c = st.current
-    actual = int(st.V[x(c)]) + int(st.V[y(c)])
-    if actual > 0xFF:
-        st.V[0xF] = np.uint8(1)
-    else:
-        st.V[0xF] = np.uint8(0)
-    st.V[x(c)] = np.add(st.V[x(c)], st.V[y(c)])
+    V = st.V
+    V[0xF] = (V[x] + V[y]) > 0xFF
+    V[x] = (V[x] + V[y]) & 0xFF
 
 
-def op_8xy5(st):
+def op_8xy5(x, y, st):
     # SUB Vx, Vy
-    c = st.current
-    if st.V[y(c)] > st.V[x(c)]:
-        st.V[0xF] = np.uint8(0)
-    else:
-        st.V[0xF] = np.uint8(1)
-    st.V[x(c)] = np.subtract(st.V[x(c)], st.V[y(c)])
+    V = st.V
+    V[0xF] = V[y] <= V[x]
+    V[x] = (V[x] - V[y]) & 0xFF
 
 
-def op_8xy6(st):
+def op_8xy6(x, y, st):
     # SHR Vx {, Vy}
-    c = st.current
-    if st.V[x(c)] & 0x1:
-        st.V[0xF] = np.uint8(1)
-    else:
-        st.V[0xF] = np.uint8(0)
-    st.V[x(c)] = np.right_shift(st.V[x(c)], 1)
+    V = st.V
+    V[0xF] = V[x] & 0x1
+    V[x] >>= 1
 
 
-def op_8xy7(st):
+def op_8xy7(x, y, st):
     # SUBN Vx, Vy
-    c = st.current
-    if st.V[x(c)] > st.V[y(c)]:
-        st.V[0xF] = np.uint8(0)
-    else:
-        st.V[0xF] = np.uint8(1)
-    st.V[y(c)] = np.subtract(st.V[y(c)], st.V[x(c)])
+    V = st.V
+    V[0xF] = V[x] <= V[y]
+    V[y] = (V[y] - V[x]) & 0xFF
 
 
-def op_8xyE(st):
+def op_8xyE(x, y, st):
     # SHL Vx {, Vy}
-    c = st.current
-    if st.V[x(c)] & 0x80:
-        st.V[0xF] = np.uint8(1)
-    else:
-        st.V[0xF] = np.uint8(0)
-    st.V[x(c)] = np.left_shift(st.V[x(c)], 1)
+    V = st.V
+    V[0xF] = V[x] >> 7
+    V[x] = (V[x] << 1) & 0xFF
 
 
-def op_9xy0(st):
+def op_9xy0(x, y, st):
     # SNE Vx, Vy
-    c = st.current
-    if np.not_equal(st.V[x(c)], st.V[y(c)]):
+    if st.V[x] != st.V[y]:
         st.PC += SZ_INSTR
 
 
-def op_Annn(st):
+def op_Annn(nnn, st):
     # LD I, nnn
-    c = st.current
-    st.I = nnn(c)
+    st.I = nnn
 
 
-def op_Bnnn(st):
+def op_Bnnn(nnn, st):
     # JP V0, nnn
-    c = st.current
-    st.PC = np.add(np.uint16(st.V[0]), nnn(c))
+    st.PC = (st.V[0] + nnn) & 0xFFFF
 
 
-def op_Cxkk(st):
+def op_Cxkk(x, kk, st):
     # RND Vx, kk
-    c = st.current
-    st.V[x(c)] = np.bitwise_and(np.uint8(random.random() * 0xFF), kk(c))
+    # Step the 64-bit LCG and use its top byte, the low bits are weak
+    st.rng = (st.rng * 6364136223846793005 + 1442695040888963407) & 0xFFFFFFFFFFFFFFFF
+    st.V[x] = (st.rng >> 56) & kk
 
 
-def op_Dxyn(st):
+def op_Dxyn(x, y, n, st):
     # DRW Vx, Vy, n
-    c = st.current
-    sprite = st.memory[st.I:st.I+n(c)]
-    collision = st.display.draw_sprite(st.V[x(c)], st.V[y(c)], sprite)
-    st.V[0xF] = np.uint8(collision)
+    sprite = st.memory[st.I:st.I+n]
+    st.V[0xF] = st.display.draw_sprite(st.V[x], st.V[y], sprite)
 
 
-def op_Ex9E(st):
+def op_Ex9E(x, st):
     # SKP Vx
-    c = st.current
-    if st.keyboard[st.V[x(c)]]:
+    if st.keyboard[st.V[x]]:
         st.PC += SZ_INSTR
 
 
-def op_ExA1(st):
+def op_ExA1(x, st):
     # SKNP Vx
-    c = st.current
-    if not st.keyboard[st.V[x(c)]]:
+    if not st.keyboard[st.V[x]]:
         st.PC += SZ_INSTR
 
 
-def op_Fx07(st):
+def op_Fx07(x, st):
     # LD Vx, DT
-    c = st.current
-    st.V[x(c)] = st.DT
+    st.V[x] = st.DT
 
 
-def op_Fx0A(st):
+def op_Fx0A(x, st):
     # LD Vx, K
-    c = st.current
-    if np.any(st.keyboard):
-        K = st.keyboard.nonzero()[0][0]
-        st.V[x(c)] = np.uint8(K)
+    if any(st.keyboard):
+        st.V[x] = next(K for K, pressed in enumerate(st.keyboard) if pressed)
     else:
         # PC is not incremented until a key is pressed
         st.PC -= SZ_INSTR
 
 
-def op_Fx15(st):
+def op_Fx15(x, st):
     # LD DT, Vx
-    c = st.current
-    st.DT = st.V[x(c)]
+    st.DT = st.V[x]
 
 
-def op_Fx18(st):
+def op_Fx18(x, st):
     # LD ST, Vx
-    c = st.current
-    st.ST = st.V[x(c)]
+    st.ST = st.V[x]
 
 
-def op_Fx1E(st):
+def op_Fx1E(x, st):
     # ADD I, Vx
-    c = st.current
-    actual = int(st.I) + int(st.V[x(c)])
-    if actual > 0xFFFF:
-        st.V[0xF] = np.uint8(1)
-    else:
-        st.V[0xF] = np.uint8(0)
-    st.I = np.add(st.I, st.V[x(c)])
+    st.V[0xF] = (st.I + st.V[x]) > 0xFFFF
+    st.I = (st.I + st.V[x]) & 0xFFFF
 
 
-def op_Fx29(st):
+def op_Fx29(x, st):
     # LD F, Vx
-    c = st.current
-    st.I = constants.FONT_OFFSET + np.uint16(st.V[x(c)]) * constants.FONT_SIZE
+    st.I = constants.FONT_OFFSET + st.V[x] * constants.FONT_SIZE
 
 
-def op_Fx33(st):
+def op_Fx33(x, st):
     # LD B, Vx
-    c = st.current
-    st.memory[st.I] = st.V[x(c)] // 100
-    st.memory[st.I+1] = (st.V[x(c)] % 100) // 10
-    st.memory[st.I+2] = st.V[x(c)] % 10
+    value = st.V[x]
+    st.memory[st.I] = value // 100
+    st.memory[st.I+1] = (value % 100) // 10
+    st.memory[st.I+2] = value % 10
 
 
-def op_Fx55(st):
+def op_Fx55(x, st):
     # LD [I], Vx
-    c = st.current
-    for i in range(x(c)+1):
+    for i in range(x+1):
         st.memory[st.I+i] = st.V[i]
 
 
-def op_Fx65(st):
+def op_Fx65(x, st):
     # LD Vx, [I]
-    c = st.current
-    for i in range(x(c)+1):
+    for i in range(x+1):
         st.V[i] = st.memory[st.I+i]
@@ -0,0 +1,100 @@
+import math
+import time
+
+from . import constants
+
+
+class FrameLimiter(object):
+    '''Paces a loop at a fixed frequency on perf_counter deadlines.
+
+    Frame n is due at start + n / frequency, so sleeping too long on one
+    frame is made up on the next ones instead of accumulating drift. When
+    the loop falls behind, the 'catch_up' policy runs the late frames
+    without waiting, up to max_lag frames, and 'drop' gives up on them and
+    realigns the schedule on the next deadline.
+
+    time.sleep often overshoots by a fraction of a millisecond. With spin
+    set, the last spin seconds before a deadline are busy-waited instead,
+    trading CPU time for a lower jitter.
+    '''
+
+    POLICIES = ('catch_up', 'drop')
+
+    def __init__(self, frequency=constants.FREQUENCY, policy='catch_up', max_lag=5, spin=0.0,
+                 clock=time.perf_counter, sleep=time.sleep):
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown pacing policy: %s' % policy)
+        self.period = 1.0 / frequency
+        self.policy = policy
+        self.max_lag = max_lag
+        self.spin = spin
+        self._clock = clock
+        self._sleep = sleep
+        self.reset_stats()
+        self.restart()
+
+    def restart(self):
+        # The next frame is due one period from now
+        self._deadline = self._clock() + self.period
+
+    def reset_stats(self):
+        self.frames = 0
+        self.late_frames = 0
+        self.dropped_frames = 0
+        # Running mean and variance of the lateness (Welford)
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.max_lateness = 0.0
+
+    def wait(self):
+        # Wait for the deadline of the current frame
+        clock = self._clock
+        deadline = self._deadline
+        now = clock()
+        late = now >= deadline
+        if not late:
+            remaining = deadline - now
+            if remaining > self.spin:
+                self._sleep(remaining - self.spin)
+            if self.spin:
+                while clock() < deadline:
+                    pass
+            now = clock()
+
+        lateness = now - deadline
+        self._record(lateness, late)
+
+        # Number of frames we are behind the schedule
+        behind = int(lateness / self.period)
+        if behind and (self.policy == 'drop' or behind > self.max_lag):
+            deadline += behind * self.period
+            self.dropped_frames += behind
+        self._deadline = deadline + self.period
+
+    def _record(self, lateness, late):
+        self.frames += 1
+        self.late_frames += late
+        delta = lateness - self._mean
+        self._mean += delta / self.frames
+        self._m2 += delta * (lateness - self._mean)
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+
+    def get_stats(self):
+        # Lateness of the frames after their deadline, in seconds. The
+        # jitter is its standard deviation.
+        jitter = math.sqrt(self._m2 / (self.frames - 1)) if self.frames > 1 else 0.0
+        return {
+            'frames': self.frames,
+            'late_frames': self.late_frames,
+            'dropped_frames': self.dropped_frames,
+            'mean_lateness': self._mean,
+            'max_lateness': self.max_lateness,
+            'jitter': jitter,
+        }
+
+    def __repr__(self):
+        stats = self.get_stats()
+        return 'FrameLimiter(frames=%d, late=%d, dropped=%d, mean_lateness=%.3fms, jitter=%.3fms)' % (
+            stats['frames'], stats['late_frames'], stats['dropped_frames'],
+            stats['mean_lateness'] * 1e3, stats['jitter'] * 1e3)
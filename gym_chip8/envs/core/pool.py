@@ -0,0 +1,142 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import constants, kernel
+from .display import Display
+from .state import MEMORY_OFFSET, DISPLAY_OFFSET
+
+
+def _cycle_vms(vms):
+    for vm in vms:
+        vm.cycle()
+
+
+class VMPool(object):
+    '''Steps many VMs on a pool of threads.
+
+    The state buffers and displays of the VMs are moved into two arrays
+    owned by the pool, one row per VM, that the compiled kernel steps
+    without holding the GIL, so the threads run in parallel. The VMs keep
+    working on their own, their state simply lives in the pool.
+
+    The kernel needs numba. VMs it can't run (profiled, frame limited,
+    hooked, paged or packed display) and pools created without numba are
+    stepped with VM.cycle on the same threads, which holds the GIL.
+    '''
+
+    def __init__(self, vms, max_workers=None, use_kernel=True):
+        self.vms = list(vms)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.use_kernel = use_kernel and kernel.run_cycles is not None
+        self._executor = ThreadPoolExecutor(self.max_workers)
+
+        count = len(self.vms)
+        self._blobs = np.zeros((count, DISPLAY_OFFSET), dtype=np.uint8)
+        shape = count, constants.SCREEN_ROWS, constants.SCREEN_COLS
+        self._displays = np.zeros(shape, dtype=np.uint8)
+        self._wraps = np.zeros(count, dtype=np.bool_)
+        # Instructions run, dirty rows and memory writes of each VM
+        self._status = np.zeros((count, 3), dtype=np.int64)
+        # Rows of each VM, and the state adopted in them, None until adopted
+        self._blob_rows = list(self._blobs)
+        self._display_rows = list(self._displays)
+        self._states = [None] * count
+
+    def _is_eligible(self, vm):
+        # The kernel mirrors the unhooked handlers on a plain Display
+        state = vm.state
+        return (self.use_kernel and type(state.display) is Display and not state.is_paged() and
+                not vm.cpu.optable.hooked and vm._profiler is None and not vm._frame_limiting)
+
+    def _adopt(self, index, vm):
+        # Move the state buffer and the display of the VM into its rows,
+        # again after every reset since it replaces the state
+        state = vm.state
+        if self._states[index] is state and state.display.buffer is self._display_rows[index]:
+            return
+        blob = self._blob_rows[index]
+        blob[:] = np.frombuffer(state._blob, dtype=np.uint8)
+        state._blob = blob
+        state.memory = memoryview(blob)[MEMORY_OFFSET:]
+        state._bind_views()
+        vm._state_array_owner = None
+
+        display = self._display_rows[index]
+        display[:] = state.display.buffer
+        state.display.buffer = display
+        self._wraps[index] = state.display.wrap
+        self._states[index] = state
+
+    def step(self, actions=None, cycles=1, out=None):
+        # Take the actions (one per VM, or none) before each of the cycles,
+        # and return the displays of all the VMs as a (N, 32, 64) array
+        indices = []
+        others = []
+        for index, vm in enumerate(self.vms):
+            if self._is_eligible(vm):
+                self._adopt(index, vm)
+                indices.append(index)
+            else:
+                others.append(vm)
+        indices = np.array(indices, dtype=np.intp)
+        shards = [shard for shard in np.array_split(indices, self.max_workers) if len(shard)]
+        # One chunk of the other VMs per worker as well, a future per VM
+        # costs more than its cycle
+        others = [chunk for chunk in (others[start::self.max_workers] for start in range(self.max_workers)) if chunk]
+
+        for _ in range(cycles):
+            if actions is not None:
+                for vm, action in zip(self.vms, actions):
+                    vm.take_action(action)
+            self._cycle(indices, shards, others)
+
+        if out is None:
+            out = np.empty(self._displays.shape, dtype=np.uint8)
+        for index, vm in enumerate(self.vms):
+            if self._states[index] is vm.state:
+                out[index] = self._displays[index]
+            else:
+                out[index] = vm.state.display.buffer
+        return out
+
+    def _cycle(self, indices, shards, others):
+        pressed_keys = dict()
+        for index in indices:
+            vm = self.vms[index]
+            pressed_keys[index] = vm._press_next_key()
+            vm.state._pack_registers()
+
+        count = constants.INSTRUCTIONS_PER_CYCLE
+        futures = [self._executor.submit(kernel.run_cycles, self._blobs, self._displays, self._wraps,
+                                         shard, count, self._status) for shard in shards]
+        futures += [self._executor.submit(_cycle_vms, chunk) for chunk in others]
+        for future in futures:
+            future.result()
+
+        for index in indices:
+            vm = self.vms[index]
+            state = vm.state
+            state._unpack_registers()
+            executed, dirty, stored = self._status[index]
+            if stored:
+                vm.cpu.invalidate_cache()
+            if dirty:
+                state.display._touch_rows(int(dirty))
+            if executed < count:
+                # The kernel stopped before an instruction only the
+                # interpreter handles, it runs the rest of the cycle
+                vm.cpu.run(count - executed)
+                vm._update_timers()
+                state.cycle += 1
+            vm._release_key(pressed_keys[index])
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,81 @@
+import os
+import glob
+import json
+from types import MappingProxyType
+
+from . import constants
+from .state import FONT
+
+# Profiles already loaded, by real path
+_rom_profiles = {}
+
+
+def _freeze(value):
+    # Read-only copy of a parsed JSON value
+    if isinstance(value, dict):
+        return MappingProxyType(dict((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class RomProfile(object):
+    '''A ROM profile and its ROM, parsed once and shared by all the VMs.
+
+    profile is a read-only view of the JSON profile: the ROM file name, the
+    keys of the actions, the variables and, optionally, the variable the
+    reward is the increase of and the variable value ending an episode:
+
+        "reward": "score",
+        "done": {"variable": "balls_remaining", "value": 0}
+
+    image is the whole memory right after loading the ROM, font included,
+    so loading it is a single copy.
+    '''
+
+    __slots__ = ('name', 'path', 'profile', 'rom', 'image')
+
+    def __init__(self, path):
+        with open(path) as profile_file:
+            profile = json.load(profile_file)
+        rompath = os.path.join(os.path.dirname(path), profile["rom"])
+        with open(rompath, 'rb') as rom_file:
+            rom = rom_file.read(constants.MEMORY_SIZE - constants.PROGRAM_OFFSET)
+
+        image = bytearray(constants.MEMORY_SIZE)
+        offset = constants.FONT_OFFSET
+        image[offset:offset+len(FONT)] = FONT
+        offset = constants.PROGRAM_OFFSET
+        image[offset:offset+len(rom)] = rom
+
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.path = path
+        self.profile = _freeze(profile)
+        self.rom = rom
+        self.image = bytes(image)
+
+    @property
+    def reward(self):
+        return self.profile.get("reward")
+
+    @property
+    def done(self):
+        return self.profile.get("done")
+
+    def __repr__(self):
+        return 'RomProfile(%r)' % self.name
+
+
+def load_rom_profile(path):
+    # The profile at path, only read from disk the first time
+    path = os.path.realpath(path)
+    rom_profile = _rom_profiles.get(path)
+    if rom_profile is None:
+        rom_profile = _rom_profiles[path] = RomProfile(path)
+    return rom_profile
+
+
+def find_rom_profiles(directory):
+    # Paths of the profiles in directory, by game name
+    paths = sorted(glob.glob(os.path.join(directory, '*.json')))
+    return dict((os.path.splitext(os.path.basename(path))[0], path) for path in paths)
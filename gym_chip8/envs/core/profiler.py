@@ -0,0 +1,92 @@
+from . import constants
+
+# Name of the bottom frame in stack dumps
+ROOT_FRAME = 'main'
+
+
+class Profiler(object):
+    '''Counters filled in by a CPU and VM with profiling enabled.
+
+    Every executed instruction is counted by opcode, by address (the PC heat
+    map) and by call stack. The call stack is shadowed by following CALL and
+    RET, so that the time spent in each ROM subroutine can be dumped in the
+    collapsed format read by flamegraph.pl and speedscope.
+    '''
+
+    def __init__(self, get_opcode_key=None):
+        self.get_opcode_key = get_opcode_key
+        self.reset()
+
+    def reset(self):
+        self.opcode_counts = [0] * 0x10000
+        self.pc_counts = [0] * constants.MEMORY_SIZE
+        self.draw_calls = 0
+        self.stack_counts = dict()
+        self._stack = [ROOT_FRAME]
+        self._stack_key = ROOT_FRAME
+
+        # Wall time spent in VM.cycle
+        self.cycles = 0
+        self.cycle_time = 0.0
+        self.max_cycle_time = 0.0
+
+    def record(self, pc, opcode):
+        # Called before the instruction at pc is executed
+        self.opcode_counts[opcode] += 1
+        self.pc_counts[pc] += 1
+
+        stack_key = self._stack_key
+        self.stack_counts[stack_key] = self.stack_counts.get(stack_key, 0) + 1
+
+        kind = opcode >> 12
+        if kind == 0xD:
+            self.draw_calls += 1
+        elif kind == 0x2:
+            self._stack.append('0x%03X' % (opcode & 0xFFF))
+            self._stack_key = ';'.join(self._stack)
+        elif opcode == 0x00EE and len(self._stack) > 1:
+            self._stack.pop()
+            self._stack_key = ';'.join(self._stack)
+
+    def record_cycle(self, elapsed):
+        self.cycles += 1
+        self.cycle_time += elapsed
+        if elapsed > self.max_cycle_time:
+            self.max_cycle_time = elapsed
+
+    def get_instruction_count(self):
+        return sum(self.opcode_counts)
+
+    def get_histogram(self):
+        # Instruction counts by opcode key, e.g. 'Dxyn', most frequent first
+        histogram = dict()
+        for opcode, count in enumerate(self.opcode_counts):
+            if not count:
+                continue
+            try:
+                key = self.get_opcode_key(opcode)
+            except (KeyError, TypeError):
+                key = '0x%04X' % opcode
+            histogram[key] = histogram.get(key, 0) + count
+        return sorted(histogram.items(), key=lambda item: -item[1])
+
+    def get_hot_addresses(self, count=None):
+        # (address, instruction count) pairs, hottest first
+        addresses = [(address, hits) for address, hits in enumerate(self.pc_counts) if hits]
+        addresses.sort(key=lambda item: -item[1])
+        return addresses[:count]
+
+    def dump_histogram(self, file):
+        total = self.get_instruction_count() or 1
+        for key, count in self.get_histogram():
+            file.write('%-6s %12d %6.2f%%\n' % (key, count, 100.0 * count / total))
+
+    def dump_stacks(self, file):
+        # One 'frame;frame;frame count' line per call stack
+        for stack, count in sorted(self.stack_counts.items()):
+            file.write('%s %d\n' % (stack, count))
+
+    def __repr__(self):
+        mean = self.cycle_time / self.cycles if self.cycles else 0.0
+        return 'Profiler(instructions=%d, draw_calls=%d, cycles=%d, mean_cycle_time=%.1fus)' % (
+            self.get_instruction_count(), self.draw_calls, self.cycles, mean * 1e6)
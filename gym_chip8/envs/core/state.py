@@ -1,53 +1,99 @@
-import numpy as np
+import random
+import struct
 import binascii
 from . import constants
 from .display import Display
+from .memory import PagedMemory
+
+# Decoded once, copied into the memory of every new state
+FONT = binascii.a2b_hex(constants.FONTDATA)
+
+# Layout of the contiguous buffer holding the machine state. V, keyboard,
+# stack and memory are views into it, scalar registers are packed into it
+# when a snapshot is taken. Memory comes last so that states with paged
+# memory can leave it out. Snapshots append the display after it.
+V_OFFSET = 0
+KEYBOARD_OFFSET = V_OFFSET + 16
+STACK_OFFSET = KEYBOARD_OFFSET + 16
+REGISTERS_OFFSET = STACK_OFFSET + 2 * 16
+REGISTERS = struct.Struct('<HHBBBHQQ??')  # I, PC, SP, DT, ST, current, cycle, rng, changed flags
+MEMORY_OFFSET = REGISTERS_OFFSET + REGISTERS.size
+DISPLAY_OFFSET = MEMORY_OFFSET + constants.MEMORY_SIZE
+
+RNG_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def seed_rng(seed):
+    # Scramble the seed with splitmix64, so that nearby seeds give unrelated
+    # RND streams
+    z = (seed + 0x9E3779B97F4A7C15) & RNG_MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & RNG_MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & RNG_MASK
+    return z ^ (z >> 31)
 
 
 class State():
-    def __init__(self, *args, **kwargs):
+    # Registers are plain ints and byte arrays are views into a single
+    # bytearray, handlers mask 8-bit and 16-bit wraparound explicitly
+    __slots__ = (
+        '_output_has_changed', '_blob', 'memory', 'display', 'keyboard',
+        'V', 'I', 'SP', 'DT', '_ST', 'stack', 'PC', 'current', 'cycle', 'rng',
+    )
+
+    def __init__(self, *args, display=None, paged=False, seed=None, **kwargs):
         self._output_has_changed = False
-        self.memory = np.zeros(constants.MEMORY_SIZE, dtype=np.uint8)
+        if paged:
+            # Memory pages are shared copy-on-write with forked states
+            self._blob = bytearray(MEMORY_OFFSET)
+            self.memory = PagedMemory()
+        else:
+            self._blob = bytearray(DISPLAY_OFFSET)
+            self.memory = memoryview(self._blob)[MEMORY_OFFSET:]
 
         # Load the hex font
-        font = np.fromstring(
-            binascii.a2b_hex(constants.FONTDATA),
-            dtype=np.uint8
-        )
         offset = constants.FONT_OFFSET
-        self.memory[offset:offset+len(font)] = font
-
-        self.display = Display()
+        self.memory[offset:offset+len(FONT)] = FONT
 
-        self.keyboard = np.zeros(16, dtype=np.bool_)
+        self.display = display if display is not None else Display()
 
-        self.V = np.zeros(16, dtype=np.uint8)
-        self.I = np.uint16()
-        self.SP = np.uint8()
+        self._bind_views()
+        self.I = 0
+        self.SP = 0
 
         self.DT = 0
 
         # Track changes on ST (sound events)
         self._ST = 0
 
-        self.stack = np.zeros(16, dtype=np.uint16)
-
         # Set the PC to the first instruction of the ROM
-        self.PC = np.uint16(constants.PROGRAM_OFFSET)
+        self.PC = constants.PROGRAM_OFFSET
+        self.current = 0
 
-    def __getattr__(self, key):
-        if key == 'ST':
-            return self._ST
-        else:
-            super().__getattr__(key)
+        # Number of cycles run by the VM
+        self.cycle = 0
 
-    def __setattr__(self, key, val):
-        if key == 'ST':
-            # Any changes from/to zero and nonzero are sound events
-            self._output_has_changed |= bool(self._ST) ^ bool(val)
-            self._ST = val
-        else:
-            super().__setattr__(key, val)
+        # State of the 64-bit LCG used by RND, seeded from the global
+        # generator unless a seed is given
+        self.rng = random.getrandbits(64) if seed is None else seed_rng(seed)
+
+    def _bind_views(self):
+        view = memoryview(self._blob)
+        self.V = view[V_OFFSET:V_OFFSET+16]
+        self.keyboard = view[KEYBOARD_OFFSET:KEYBOARD_OFFSET+16]
+        self.stack = view[STACK_OFFSET:REGISTERS_OFFSET].cast('H')
+
+    def is_paged(self):
+        return type(self.memory) is PagedMemory
+
+    @property
+    def ST(self):
+        return self._ST
+
+    @ST.setter
+    def ST(self, val):
+        # Any changes from/to zero and nonzero are sound events
+        self._output_has_changed |= bool(self._ST) ^ bool(val)
+        self._ST = val
 
     def output_has_changed(self):
         result = self._output_has_changed or self.display._buffer_has_changed
@@ -56,9 +102,48 @@ class State():
 
         return result
 
+    def _pack_registers(self):
+        REGISTERS.pack_into(self._blob, REGISTERS_OFFSET, self.I, self.PC, self.SP, self.DT, self._ST,
+                            self.current, self.cycle, self.rng, self._output_has_changed,
+                            self.display._buffer_has_changed)
+
+    def _unpack_registers(self):
+        (self.I, self.PC, self.SP, self.DT, self._ST, self.current, self.cycle, self.rng,
+         self._output_has_changed, self.display._buffer_has_changed) = REGISTERS.unpack_from(self._blob, REGISTERS_OFFSET)
+
+    def snapshot(self):
+        # Pack the registers next to the memory, then copy the buffer
+        # followed by the display
+        self._pack_registers()
+        memory = bytes(self.memory) if self.is_paged() else b''
+        return b''.join((self._blob, memory, self.display.dumps()))
+
+    def restore(self, snapshot):
+        # A single copy restores registers, V, keyboard, stack and memory in place
+        view = memoryview(snapshot)
+        self._blob[:] = view[:len(self._blob)]
+        if self.is_paged():
+            self.memory.load(view[MEMORY_OFFSET:DISPLAY_OFFSET])
+        self._unpack_registers()
+        self.display.load(view[DISPLAY_OFFSET:])
+
+    def fork(self):
+        # Copy of the state sharing the memory pages if they are paged
+        self._pack_registers()
+        state = State.__new__(State)
+        state._blob = bytearray(self._blob)
+        if self.is_paged():
+            state.memory = self.memory.fork()
+        else:
+            state.memory = memoryview(state._blob)[MEMORY_OFFSET:]
+        state.display = self.display.copy()
+        state._bind_views()
+        state._unpack_registers()
+        return state
+
     def __repr__(self):
         return 80 * '*' + '\n' + '\n'.join((
-            "PC=0x{:04X}\t I=0x{:04X}\nVF=0x{:04X}\tSP=0x{:04X}".format(self.PC, self.I, self.VF, self.SP),
+            "PC=0x{:04X}\t I=0x{:04X}\nVF=0x{:04X}\tSP=0x{:04X}".format(self.PC, self.I, self.V[0xF], self.SP),
             "DT=0x{:04X}\tST=0x{:04X}".format(self.DT, self.ST),
             '\t'.join(["V{:02}=0x{:02X}".format(i, v) for i, v in enumerate(self.V[:8])]),
             '\t'.join(["V{:02}=0x{:02X}".format(i+8, v) for i, v in enumerate(self.V[8:])]),
@@ -1,49 +1,218 @@
-import os
-import json
 import time
+import random
 import numpy as np
 from .cpu import CPU
-from .state import State
+from .state import State, seed_rng, V_OFFSET, MEMORY_OFFSET, DISPLAY_OFFSET
+from .display import Display, PackedDisplay
+from .pacing import FrameLimiter
+from .profile import load_rom_profile
 from . import constants
 
 
 NO_ACTION = -1
 
 class Frame():
-    def __init__(self, cycle_index, buffer, buzzer_state, delta, variables=None):
+    def __init__(self, cycle_index, buffer, buzzer_state, delta, variables=None, dirty_rows=(0, 0)):
         self.cycle_index = cycle_index
         self.buffer = buffer
         self.buzzer_state = buzzer_state
         self.delta = delta
         self.variables = variables
+        # (start, end) range of the display rows changed since the previous
+        # frame, empty when nothing was drawn
+        self.dirty_rows = dirty_rows
+
+
+# Size of the RAM returned by VM.get_ram: V, keyboard, stack, registers
+# and memory, laid out as in the state buffer
+RAM_SIZE = DISPLAY_OFFSET
 
 
 class VM():
-    def __init__(self, *args, frame_limiting=False, **kwargs):
+    def __init__(self, *args, frame_limiting=False, frame_limiter=None, display_class=Display, wrap=False,
+                 cpu_mode='interpreter', paged_memory=False, headless=False, **kwargs):
         self._profile = {}
+        self._actions = (NO_ACTION,)
+        # Paces cycles at FREQUENCY when frame limiting is enabled, a
+        # default FrameLimiter is created if none is given
         self._frame_limiting = frame_limiting
+        self.frame_limiter = frame_limiter if frame_limiter is not None else FrameLimiter()
+        # Headless VMs only track the pixels needed for collisions, in the
+        # bitset of a PackedDisplay, and their frames hold the RAM instead
+        # of the display
+        self.headless = headless
+        if headless:
+            display_class = PackedDisplay
+        # Display backend (Display or PackedDisplay) and sprite wraparound
+        self._display_class = display_class
+        self._wrap = wrap
+        self._cpu_mode = cpu_mode
+        # Share memory pages copy-on-write between forks
+        self._paged_memory = paged_memory
         self._keypress_queue = []
+        self._pooled_buffer = None
+        self._profiler = None
+        # Snapshot of the machine after loading a profile, see load_profile
+        self._boot_snapshot = None
+        self._compile_variables()
         self.reset()
 
-    def reset(self):
-        self._current_cycle = 0
-        self.state = State()
-        self.cpu = CPU(self.state)
+    def reset(self, seed=None):
+        # The same seed always gives the same RND stream
+        if self._boot_snapshot is not None:
+            # Copy the boot snapshot into the current state and display,
+            # the CPU, its compiled blocks and its hooks are kept
+            self.restore(self._boot_snapshot)
+            self.state.rng = random.getrandbits(64) if seed is None else seed_rng(seed)
+        else:
+            self.state = State(display=self._display_class(wrap=self._wrap), paged=self._paged_memory, seed=seed)
+            self.cpu = CPU(self.state, mode=self._cpu_mode)
+            self._state_array_owner = None
+
+            # Keep profiling across resets
+            if self._profiler is not None:
+                self.cpu.enable_profiling(self._profiler)
+
+        # Display buffer of the last frame, shared by the next frames until
+        # the display changes, and the display version it was taken at
+        self._frame_buffer = None
+        self._frame_buffer_version = -1
+        # Display version of the last frame, for its dirty rows
+        self._frame_version = -1
         #self.cpu.post_hook('Fx18', sound_hook)
-        self._last_cycle_timestamp = time.time()
+        self.frame_limiter.restart()
 
     def load_rom(self, path):
-        rom = np.fromfile(path, dtype=np.uint8)
+        with open(path, 'rb') as rom_file:
+            rom = rom_file.read(constants.MEMORY_SIZE - constants.PROGRAM_OFFSET)
+        self.load_rom_data(rom)
 
-        # Assign the ROM array directly to the program code offset
+    def load_rom_data(self, rom):
+        # Assign the ROM bytes directly to the program code offset. Resets
+        # start from an empty machine again.
         offset = constants.PROGRAM_OFFSET
         self.state.memory[offset:offset+len(rom)] = rom
-
-    def load_rom_profile(self, path):
-        with open(path) as profile_file:
-            self._profile = json.load(profile_file)
-            rompath = os.path.join(os.path.dirname(path), self._profile["rom"])
-            self.load_rom(rompath)
+        self.cpu.invalidate_cache()
+        self._boot_snapshot = None
+
+    def load_rom_profile(self, path, boot_frames=0):
+        # Profiles are parsed once, see RomProfile
+        self.load_profile(load_rom_profile(path), boot_frames)
+
+    def load_profile(self, rom_profile, boot_frames=0):
+        # Copy the memory image of the ROM, font included, in one go
+        self._boot_snapshot = None
+        memory = self.state.memory
+        if self.state.is_paged():
+            memory.load(rom_profile.image)
+        else:
+            memory[:] = rom_profile.image
+        self.cpu.invalidate_cache()
+
+        # Reloading the same profile keeps the compiled variables
+        if self._profile is not rom_profile.profile:
+            self._profile = rom_profile.profile
+            self._actions = (NO_ACTION,) + tuple(self._profile.get("actions", ()))
+            self._compile_variables()
+
+        # Following resets restore the machine as it is now, after running
+        # boot_frames cycles without input to skip e.g. a title screen.
+        # Those cycles always use the same RND stream.
+        if boot_frames:
+            frame_limiting, self._frame_limiting = self._frame_limiting, False
+            self.state.rng = seed_rng(0)
+            for _ in range(boot_frames):
+                VM.cycle(self)
+            self.state.output_has_changed()
+            self._frame_limiting = frame_limiting
+        self._boot_snapshot = self.snapshot()
+
+    def _compile_variables(self):
+        # Each variable is the dot product of three bytes of the state buffer
+        # with its weights: the BCD digits in memory, or a register and two
+        # zero weights. All of them are read with a single gather.
+        names = list(self._profile.get("variables", {}))
+        table = dict()
+        indices = np.zeros((len(names), 3), dtype=np.intp)
+        weights = np.zeros((len(names), 3, len(names)), dtype=np.int64)
+        for column, name in enumerate(names):
+            variable_profile = self._profile["variables"][name]
+            vartype = variable_profile["type"]
+            index = variable_profile["index"]
+
+            if vartype == "mem_bcd":
+                indices[column] = MEMORY_OFFSET + index + np.arange(3)
+                weights[column, :, column] = (100, 10, 1)
+            elif vartype == "register":
+                indices[column] = V_OFFSET + index
+                weights[column, 0, column] = 1
+            else:
+                raise ValueError("Unknown variable type: " + vartype)
+            table[name] = (vartype == "mem_bcd", index)
+
+        self._variable_table = table
+        self._variable_indices = indices.ravel()
+        self._variable_weights = weights.reshape(3 * len(names), len(names))
+        self._variable_bytes = np.zeros(len(self._variable_indices), dtype=np.uint8)
+
+        # Preallocated record holding the last values read by read_variables
+        self.variables = np.zeros(1, dtype=[(name, np.int64) for name in names])
+        self._variable_values = self.variables.view(np.int64) if names else np.zeros(0, dtype=np.int64)
+
+        # Reused by run_cycles for the intermediate frames
+        self._cycle_frame = Frame(0, None, False, False, variables=self.variables[0])
+
+    def _get_state_array(self):
+        # The state buffer as a uint8 array, with the memory at MEMORY_OFFSET
+        state = self.state
+        if state.is_paged():
+            return np.frombuffer(bytes(state._blob) + bytes(state.memory), dtype=np.uint8)
+        if self._state_array_owner is not state:
+            self._state_array = np.frombuffer(state._blob, dtype=np.uint8)
+            self._state_array_owner = state
+        return self._state_array
+
+    def read_variables(self):
+        # Read all the profile variables into the preallocated record
+        if len(self._variable_values):
+            # The indices are always in range, clip mode skips a copy of the output
+            np.take(self._get_state_array(), self._variable_indices, out=self._variable_bytes, mode='clip')
+            np.matmul(self._variable_bytes, self._variable_weights, out=self._variable_values)
+        return self.variables[0]
+
+    def snapshot(self):
+        # Machine state (memory, registers, stack, timers, keyboard,
+        # display and RNG) packed into a single bytes object
+        return self.state.snapshot()
+
+    def restore(self, snapshot):
+        # Compiled blocks only need to be dropped if the memory differs
+        if self.cpu.mode == 'jit' and bytes(self.state.memory) != snapshot[MEMORY_OFFSET:DISPLAY_OFFSET]:
+            self.cpu.invalidate_cache()
+
+        self.state.restore(snapshot)
+
+        # Pending key presses are not part of the machine state
+        del self._keypress_queue[:]
+
+    def fork(self):
+        # Independent copy of this VM. With paged memory, both VMs share their
+        # memory pages until one of them writes to it. The opcode table, and
+        # the hooks installed in it, are shared as well.
+        vm = VM.__new__(VM)
+        vm.__dict__.update(self.__dict__)
+        vm._keypress_queue = list(self._keypress_queue)
+        vm._pooled_buffer = None
+        # Forks are not profiled nor frame limited
+        vm._profiler = None
+        vm._frame_limiting = False
+        vm.frame_limiter = FrameLimiter()
+        vm.__dict__.pop('cycle', None)
+        vm._compile_variables()
+        vm.state = self.state.fork()
+        vm._state_array_owner = None
+        vm.cpu = CPU(vm.state, mode=self._cpu_mode, optable=self.cpu.optable)
+        return vm
 
     def get_display(self):
         return self.state.display
@@ -54,35 +223,67 @@ class VM():
     def get_display_buffer(self):
         return np.copy(self.state.display.buffer)
 
+    def get_ram(self, out=None):
+        # Copy of V, keyboard, stack, registers and memory as RAM_SIZE bytes
+        self.state._pack_registers()
+        ram = self._get_state_array()[:RAM_SIZE]
+        if out is None:
+            return ram.copy()
+        np.copyto(out, ram)
+        return out
+
+    def get_frame_buffer(self, out=None):
+        # The display buffer, or the RAM of headless VMs
+        if self.headless:
+            return self.get_ram(out)
+        if out is None:
+            return self.get_display_buffer()
+        np.copyto(out, self.state.display.buffer)
+        return out
+
     def get_variable(self, name):
         # Throw a key error on purpose here if the variable is not defined
-        variable_profile = self._profile["variables"][name]
-        vartype = variable_profile["type"]
-        index = variable_profile["index"]
+        is_bcd, index = self._variable_table[name]
 
-        if vartype == "mem_bcd":
-            hundreds = self.state.memory[index]
-            tens = self.state.memory[index+1]
-            ones = self.state.memory[index+2]
+        if is_bcd:
+            memory = self.state.memory
+            return memory[index] * 100 + memory[index+1] * 10 + memory[index+2]
 
-            return hundreds * 100 + tens * 10 + ones
+        return self.state.V[index]
 
-        elif vartype == "register":
-            return self.state.V[index]
+    def get_variables(self):
+        # Current values of all the variables as a dict
+        return dict(zip(self.variables.dtype.names, self.read_variables().item()))
 
-        else:
-            raise ValueError("Unknown variable type: " + vartype)
+    def _take_dirty_rows(self):
+        # Rows changed since the last frame, all of them for the first one
+        display = self.state.display
+        dirty_rows = display.get_dirty_rows(self._frame_version)
+        self._frame_version = display.version
+        return dirty_rows
 
     def get_frame(self):
-        variables = {}
-        if 'variables' in self._profile:
-            variables = dict((v, self.get_variable(v)) for v in self._profile["variables"])
+        # Frames share a read-only display buffer until the display changes
+        self.read_variables()
+        variables = self.variables.copy()[0]
+
+        dirty_rows = self._take_dirty_rows()
+        version = self.state.display.version
+        if self.headless:
+            buffer = self.get_ram()
+        elif self._frame_buffer is None or self._frame_buffer_version != version:
+            buffer = self._frame_buffer = self.get_display_buffer()
+            buffer.flags.writeable = False
+            self._frame_buffer_version = version
+        else:
+            buffer = self._frame_buffer
 
-        return Frame(self._current_cycle,
-                     self.get_display_buffer(),
+        return Frame(self.state.cycle,
+                     buffer,
                      self.get_buzzer_state(),
                      self.state.output_has_changed(),
-                     variables=variables)
+                     variables=variables,
+                     dirty_rows=dirty_rows)
 
     def key_down(self, key_index):
         self.state.keyboard[key_index] = 1
@@ -98,52 +299,117 @@ class VM():
         return len(key_actions) + 1
 
     def take_action(self, action_index):
-        key_actions = self._profile["actions"]
-        actions = [NO_ACTION] + key_actions
-        action = actions[action_index]
+        action = self._actions[action_index]
 
         if action != NO_ACTION:
             self._keypress_queue.append(action)
 
     def enable_frame_limiting(self):
         self._frame_limiting = True
+        self.frame_limiter.restart()
 
     def disable_frame_limiting(self):
         self._frame_limiting = False
 
-    def cycle(self):
-        # Cycles normally occur at a 60Hz frequency
+    def enable_profiling(self, profiler=None):
+        # Count instructions on the CPU and time every cycle, see Profiler
+        self._profiler = self.cpu.enable_profiling(profiler)
+        self.cycle = self._profiled_cycle
+        return self._profiler
+
+    def disable_profiling(self):
+        self.cpu.disable_profiling()
+        self.__dict__.pop('cycle', None)
+        profiler, self._profiler = self._profiler, None
+        return profiler
 
+    def _profiled_cycle(self):
+        start = time.perf_counter()
+        VM.cycle(self)
+        self._profiler.record_cycle(time.perf_counter() - start)
+
+    def _press_next_key(self):
         # Keypress are key events that last for a single frame
         pressed_key = None
         if self._keypress_queue:
             pressed_key = self._keypress_queue.pop(0)
             self.state.keyboard[pressed_key] = 0x1
+        return pressed_key
 
-        # The CPU clock should be around ~500Hz, so we set
-        # INSTRUCTIONS_PER_CYCLE = 9
-        for _ in range(constants.INSTRUCTIONS_PER_CYCLE):
-            self.cpu.step()
+    def _release_key(self, pressed_key):
+        # Stop pressing the key after the frame is over
+        if pressed_key is not None:
+            self.state.keyboard[pressed_key] = 0x0
 
+    def _update_timers(self):
         if self.state.DT > 0:
             self.state.DT -= 1
 
         if self.state.ST > 0:
             self.state.ST -= 1
 
-        # If frame limiting is enabled, sleep for the rest of the cycle period
+    def cycle(self):
+        # Cycles normally occur at a 60Hz frequency
+        pressed_key = self._press_next_key()
+
+        # The CPU clock should be around ~500Hz, so we set
+        # INSTRUCTIONS_PER_CYCLE = 9
+        self.cpu.run(constants.INSTRUCTIONS_PER_CYCLE)
+        self._update_timers()
+
+        # If frame limiting is enabled, wait for the end of the cycle period
         if self._frame_limiting:
-            ellapsed = time.time() - self._last_cycle_timestamp
-            remaining = 1.0/constants.FREQUENCY - ellapsed
-            if remaining > 0:
-                time.sleep(remaining)
+            self.frame_limiter.wait()
+
+        self.state.cycle += 1
+        self._release_key(pressed_key)
+
+    def run_cycles(self, count, action_index=0, on_cycle=None, max_pool=False, out=None):
+        # Run count cycles, taking the action before each one, and only build
+        # the frame of the last one. If given, on_cycle is called after every
+        # cycle with a reused frame that has no buffer, whose variables are
+        # the record refreshed by read_variables. With max_pool, the returned
+        # buffer is the pixelwise maximum of the last two frames. If out is
+        # given, the display is copied into it and the reused frame is
+        # returned instead of a new one, so nothing is allocated. Headless
+        # VMs copy their RAM instead and don't support max_pool.
+        if max_pool and self.headless:
+            raise ValueError('max_pool needs a display, the VM is headless')
+
+        frame = self._cycle_frame
+        delta = False
+        for index in range(count):
+            if max_pool and index == count - 1:
+                if self._pooled_buffer is None:
+                    self._pooled_buffer = np.empty_like(self.state.display.buffer)
+                np.copyto(self._pooled_buffer, self.state.display.buffer)
+
+            self.take_action(action_index)
+            self.cycle()
 
-        self._current_cycle += 1
-        self._last_cycle_timestamp = time.time()
+            frame.cycle_index = self.state.cycle
+            frame.buzzer_state = self.get_buzzer_state()
+            frame.delta = self.state.output_has_changed()
+            delta |= frame.delta
+            if on_cycle is not None:
+                self.read_variables()
+                on_cycle(frame)
 
-        # Stop pressing the key after the frame is over
-        if pressed_key is not None:
-            self.state.keyboard[pressed_key] = 0x0
+        if out is None:
+            result = self.get_frame()
+        else:
+            self.read_variables()
+            self.get_frame_buffer(out)
+            result = frame
+            result.buffer = out
+            result.dirty_rows = self._take_dirty_rows()
+        result.delta = delta
+        if max_pool:
+            if out is None:
+                result.buffer = np.maximum(result.buffer, self._pooled_buffer)
+            else:
+                np.maximum(result.buffer, self._pooled_buffer, out=result.buffer)
+        return result
 
     def frames(self):
         while True:
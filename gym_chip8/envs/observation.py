@@ -0,0 +1,128 @@
+import numpy as np
+
+from gym import spaces
+
+from .core.constants import SCREEN_ROWS, SCREEN_COLS
+
+
+class ObservationPipeline(object):
+    '''Preprocesses display buffers into stacked observations.
+
+    Each frame is cropped to the rows top:bottom and columns left:right of
+    crop, then downscaled by max pooling over downscale x downscale blocks,
+    so that a single lit pixel (e.g. a ball) is never lost. The last stack
+    frames are kept in a circular buffer, already in the output format:
+
+    - 'uint8': 0/1 pixels
+    - 'float32': 0.0/1.0 pixels
+    - 'packed': 8 pixels per byte, leftmost first, as np.packbits
+
+    Observations are (stack, height, width) arrays, or (height, width,
+    stack) if channels_first is False. With num_envs, buffers are batches
+    of displays, (num_envs, 32, 64) as returned by BatchedVM or VMPool, and
+    observations get a leading num_envs axis.
+
+    Each step only writes the new frame into the circular buffer, and the
+    observation is filled from it with two copies.
+    '''
+
+    OUTPUTS = ('uint8', 'float32', 'packed')
+
+    def __init__(self, crop=None, downscale=1, stack=1, output='uint8', channels_first=True, num_envs=None):
+        if output not in self.OUTPUTS:
+            raise ValueError('Unknown observation output: %s' % output)
+        top, bottom, left, right = crop if crop is not None else (0, SCREEN_ROWS, 0, SCREEN_COLS)
+        height, width = bottom - top, right - left
+        if height <= 0 or width <= 0 or height % downscale or width % downscale:
+            raise ValueError('The crop %r is not a multiple of the downscale factor %d' % (crop, downscale))
+        height //= downscale
+        width //= downscale
+        if output == 'packed' and width % 8:
+            raise ValueError('Packed observations need a multiple of 8 columns, got %d' % width)
+
+        self.crop = top, bottom, left, right
+        self.downscale = downscale
+        self.stack = stack
+        self.output = output
+        self.channels_first = channels_first
+        self.num_envs = num_envs
+        self.batch_shape = () if num_envs is None else (num_envs,)
+
+        self.dtype = np.float32 if output == 'float32' else np.uint8
+        self.frame_shape = (height, width // 8) if output == 'packed' else (height, width)
+        if channels_first:
+            self.shape = (stack,) + self.frame_shape
+        else:
+            self.shape = self.frame_shape + (stack,)
+        # Transposition of the observations bringing the stack axis first,
+        # None if it already is
+        stack_axis = len(self.batch_shape) if channels_first else len(self.batch_shape) + 2
+        axes = (stack_axis,) + tuple(axis for axis in range(len(self.batch_shape) + 3) if axis != stack_axis)
+        self._stack_axes = None if stack_axis == 0 else axes
+
+        # Circular buffer of the last frames, _index is the newest one
+        self._frames = np.zeros((stack,) + self.batch_shape + self.frame_shape, dtype=self.dtype)
+        self._index = 0
+        # Rows max pooled, then downscaled 0/1 frame before packing or
+        # conversion to float32
+        self._rows = np.zeros(self.batch_shape + (height, right - left), dtype=np.uint8)
+        self._scaled = np.zeros(self.batch_shape + (height, width), dtype=np.uint8)
+        # Frame of the last reset
+        self._reset_frame = np.zeros(self.batch_shape + self.frame_shape, dtype=self.dtype)
+
+    @property
+    def observation_space(self):
+        # Space of the observation of one env
+        return spaces.Box(low=0, high=255 if self.output == 'packed' else 1, shape=self.shape)
+
+    def _process(self, buffer, frame):
+        # Crop, downscale and convert buffer into frame
+        top, bottom, left, right = self.crop
+        source = buffer[..., top:bottom, left:right]
+        if self.downscale > 1:
+            # Max pool the rows, then the columns, with strided views. A
+            # reduction over the axes of a reshaped view is much slower.
+            factor = self.downscale
+            rows = self._rows
+            np.maximum(source[..., 0::factor, :], source[..., 1::factor, :], out=rows)
+            for offset in range(2, factor):
+                np.maximum(rows, source[..., offset::factor, :], out=rows)
+            target = frame if self.output == 'uint8' else self._scaled
+            np.maximum(rows[..., 0::factor], rows[..., 1::factor], out=target)
+            for offset in range(2, factor):
+                np.maximum(target, rows[..., offset::factor], out=target)
+            source = target
+
+        if self.output == 'packed':
+            # packbits has no out argument, but its result is 8 times smaller
+            frame[...] = np.packbits(source, axis=-1)
+        elif source is not frame:
+            np.copyto(frame, source)
+
+    def _get_observation(self, out):
+        # Copy the frames into out, oldest first
+        if out is None:
+            out = np.empty(self.batch_shape + self.shape, dtype=self.dtype)
+        stacked = out if self._stack_axes is None else out.transpose(self._stack_axes)
+
+        oldest = (self._index + 1) % self.stack
+        count = self.stack - oldest
+        stacked[:count] = self._frames[oldest:]
+        stacked[count:] = self._frames[:oldest]
+        return out
+
+    def reset(self, buffer, mask=None, out=None):
+        # Fill the stacks with the frame of buffer, only the stacks of the
+        # envs selected by mask if given
+        self._process(buffer, self._reset_frame)
+        if mask is None:
+            self._frames[:] = self._reset_frame
+        else:
+            self._frames[:, mask] = self._reset_frame[mask]
+        return self._get_observation(out)
+
+    def step(self, buffer, out=None):
+        # Push the frame of buffer and return the observation
+        self._index = (self._index + 1) % self.stack
+        self._process(buffer, self._frames[self._index])
+        return self._get_observation(out)
@@ -0,0 +1,156 @@
+import os
+import json
+
+import numpy as np
+import gym
+
+from .core.constants import SCREEN_ROWS, SCREEN_COLS
+
+# Frames are stored one bit per pixel, 256 bytes each
+FRAME_SIZE = SCREEN_ROWS * SCREEN_COLS // 8
+
+FRAMES_FILE = 'frames.bin'
+STEPS_FILE = 'steps.bin'
+META_FILE = 'meta.json'
+
+
+def get_step_dtype(variables):
+    # One record per frame. The first frame of an episode is the one
+    # returned by reset, with no action (-1) and no reward.
+    return np.dtype([
+        ('action', np.int16),
+        ('reward', np.float32),
+        ('done', np.bool_),
+        ('first', np.bool_),
+        ('variables', [(name, np.int64) for name in variables]),
+    ])
+
+
+class TrajectoryRecorder(gym.Wrapper):
+    '''Appends the frames, actions, rewards and variables of an env to files.
+
+    frames.bin holds the bit-packed frames and steps.bin a record per frame,
+    see get_step_dtype. Both files are only ever appended to, recording into
+    an existing directory adds episodes to it. Read them with
+    TrajectoryReader.
+    '''
+
+    def __init__(self, env, directory):
+        super().__init__(env)
+        self.directory = directory
+        self._vm = env.unwrapped.vm
+        if self._vm.headless:
+            raise ValueError('Headless envs have no frames to record')
+        self._pipeline = getattr(env.unwrapped, 'pipeline', None)
+        variables = self._vm.variables.dtype.names
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta_file:
+                if tuple(json.load(meta_file)['variables']) != variables:
+                    raise ValueError('%s holds trajectories with other variables' % directory)
+        else:
+            with open(meta_path, 'w') as meta_file:
+                json.dump({'variables': variables, 'frame_shape': (SCREEN_ROWS, SCREEN_COLS)}, meta_file)
+
+        self._frames_file = open(os.path.join(directory, FRAMES_FILE), 'ab')
+        self._steps_file = open(os.path.join(directory, STEPS_FILE), 'ab')
+        self._record = np.zeros(1, dtype=get_step_dtype(variables))
+
+    def _write(self, frame, action, reward, done, first):
+        record = self._record[0]
+        record['action'] = action
+        record['reward'] = reward
+        record['done'] = done
+        record['first'] = first
+        record['variables'] = self._vm.read_variables()
+
+        self._frames_file.write(np.packbits(frame).tobytes())
+        self._steps_file.write(self._record.tobytes())
+
+    def _step(self, action):
+        observation, reward, done, info = self.env.step(action)
+        # The observations of pipeline envs aren't frames, record the display
+        frame = observation if self._pipeline is None else self._vm.get_display().buffer
+        self._write(frame, action, reward, done, False)
+        return observation, reward, done, info
+
+    def _reset(self, **kwargs):
+        observation = self.env.reset(**kwargs)
+        # The frames are displays, whatever the env observes
+        self._write(self._vm.get_display().buffer, -1, 0, False, True)
+        return observation
+
+    def flush(self):
+        self._frames_file.flush()
+        self._steps_file.flush()
+
+    def _close(self):
+        self._frames_file.close()
+        self._steps_file.close()
+        return super()._close()
+
+
+class TrajectoryReader():
+    '''Memory-mapped view of the trajectories recorded by TrajectoryRecorder.
+
+    Nothing is loaded up front, sampling only reads the frames and records
+    it needs. Frames recorded after the reader was opened are not visible.
+    '''
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+        self.variables = tuple(meta['variables'])
+
+        steps_path = os.path.join(directory, STEPS_FILE)
+        frames_path = os.path.join(directory, FRAMES_FILE)
+        dtype = get_step_dtype(self.variables)
+        # Ignore a record or frame partially written by a running recorder
+        count = min(os.path.getsize(steps_path) // dtype.itemsize,
+                    os.path.getsize(frames_path) // FRAME_SIZE)
+        self.steps = np.memmap(steps_path, dtype=dtype, mode='r', shape=(count,)) if count else np.zeros(0, dtype)
+        self.frames = np.memmap(frames_path, dtype=np.uint8, mode='r', shape=(count, FRAME_SIZE)) \
+            if count else np.zeros((0, FRAME_SIZE), np.uint8)
+
+        # Index of the first frame of the episode of every frame, and the
+        # frames that follow an action
+        first = self.steps['first']
+        starts = np.where(first, np.arange(count), 0)
+        self._episode_starts = np.maximum.accumulate(starts) if count else starts
+        self._transitions = np.flatnonzero(~first)
+        if count and not first[0]:
+            # The recording started mid-episode, its first frame has no predecessor
+            self._transitions = self._transitions[1:]
+
+    def __len__(self):
+        return len(self.steps)
+
+    def get_frames(self, indices):
+        # Unpacked (len(indices), SCREEN_ROWS, SCREEN_COLS) uint8 frames
+        packed = self.frames[np.asarray(indices)]
+        return np.unpackbits(packed, axis=-1).reshape(packed.shape[:-1] + (SCREEN_ROWS, SCREEN_COLS))
+
+    def get_stacked_frames(self, indices, stack=4):
+        # The last stack frames up to each index, (len(indices), stack, rows,
+        # cols). Frames before the start of an episode repeat its first one.
+        indices = np.asarray(indices)
+        offsets = np.arange(1 - stack, 1)
+        stacked = np.maximum(indices[:, None] + offsets, self._episode_starts[indices][:, None])
+        return self.get_frames(stacked)
+
+    def sample(self, batch_size, stack=4, random_state=np.random):
+        # Random transitions: observation, action, reward, next observation
+        # and done, observations being stacks of frames
+        indices = np.sort(random_state.choice(self._transitions, batch_size))
+        steps = self.steps[indices]
+        return {
+            'observations': self.get_stacked_frames(indices - 1, stack),
+            'actions': steps['action'],
+            'rewards': steps['reward'],
+            'next_observations': self.get_stacked_frames(indices, stack),
+            'dones': steps['done'],
+            'variables': steps['variables'],
+        }
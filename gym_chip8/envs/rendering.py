@@ -0,0 +1,118 @@
+import math
+
+import numpy as np
+
+from .core.constants import SCREEN_ROWS, SCREEN_COLS
+
+SCALE = 8
+
+# Maps the 0/1 pixels of the display to RGB colors
+PALETTE = np.array([[0, 0, 0], [255, 255, 255]], dtype=np.uint8)
+
+# Color of the gaps between the tiles of a mosaic
+BORDER_COLOR = (64, 64, 64)
+
+
+class Renderer(object):
+    '''Renders displays into RGB images, scaled by an integer factor.
+
+    palette maps the pixel values of the displays to RGB colors. It is
+    turned into a lookup table of scaled pixels, scale copies of each color
+    side by side, so a row of the image is looked up with a single np.take
+    and then copied scale times.
+
+    render() draws a display into a cached image, only the rows drawn since
+    the previous call. mosaic() draws a batch of displays, e.g. of a
+    BatchedVM or VMPool, into a grid of tiles in a single image.
+    '''
+
+    def __init__(self, scale=SCALE, palette=PALETTE):
+        self.scale = scale
+        self.palette = np.array(palette, dtype=np.uint8)
+        if self.palette.ndim != 2 or self.palette.shape[1] != 3:
+            raise ValueError('The palette must be a list of RGB colors, got shape %r' % (self.palette.shape,))
+        # Row of scale pixels of each color
+        self._lut = np.repeat(self.palette[:, None, :], scale, axis=1).reshape(len(self.palette), scale * 3)
+
+        self.shape = (SCREEN_ROWS * scale, SCREEN_COLS * scale, 3)
+        self.image = np.empty(self.shape, dtype=np.uint8)
+        self._rows = np.empty((SCREEN_ROWS, SCREEN_COLS, scale * 3), dtype=np.uint8)
+        self._background = np.empty_like(self.image)
+        self._background[:] = self.palette[0]
+        # Display last rendered, and its version at the time
+        self._display = None
+        self._version = -1
+
+        # Mosaic image, its layout and its scaled rows, reused while the
+        # layout stays the same
+        self._mosaic = None
+        self._mosaic_layout = None
+        self._mosaic_rows = None
+
+    def _draw(self, buffer, rows, image):
+        # Look the rows of buffer up in the LUT, then copy each of them to
+        # scale rows of image. Both copies have long contiguous rows, unlike
+        # a broadcast over scale x scale blocks of 3 bytes.
+        np.take(self._lut, buffer, axis=0, out=rows, mode='clip')
+        count = len(buffer)
+        width = SCREEN_COLS * self.scale * 3
+        image.reshape(count, self.scale, width)[:] = rows.reshape(count, 1, width)
+
+    def render_buffer(self, buffer, out=None):
+        # Render a (32, 64) display buffer into out, or a new image
+        if out is None:
+            out = np.empty(self.shape, dtype=np.uint8)
+        self._draw(buffer, self._rows, out)
+        return out
+
+    def render(self, display):
+        # Render display into self.image and return it. Only the rows drawn
+        # since the previous call are rendered again, the image must not be
+        # modified.
+        if display is not self._display:
+            # A new display, render everything
+            self._display = display
+            self._version = -1
+        start, end = display.get_dirty_rows(self._version)
+        self._version = display.version
+
+        if start == 0 and end == SCREEN_ROWS and not display.buffer.any():
+            # Typically right after a reset, the image is the background
+            np.copyto(self.image, self._background)
+        elif start != end:
+            scale = self.scale
+            self._draw(display.buffer[start:end], self._rows[start:end], self.image[start * scale:end * scale])
+        return self.image
+
+    def mosaic(self, buffers, columns=None, padding=1, border_color=BORDER_COLOR):
+        # Render a (N, 32, 64) batch of display buffers into a grid of tiles,
+        # columns wide (about square by default), separated and surrounded
+        # by padding pixels of border_color. The image is reused by the next
+        # calls with the same layout, tiles without a display are blank.
+        count = len(buffers)
+        if columns is None:
+            columns = max(1, int(math.ceil(math.sqrt(count))))
+        rows = max(1, int(math.ceil(count / columns)))
+        layout = count, columns, padding, tuple(border_color)
+
+        height, width = SCREEN_ROWS * self.scale, SCREEN_COLS * self.scale
+        if layout != self._mosaic_layout:
+            shape = (rows * (height + padding) + padding, columns * (width + padding) + padding, 3)
+            self._mosaic = np.empty(shape, dtype=np.uint8)
+            self._mosaic[:] = border_color
+            self._mosaic_rows = np.empty((rows * columns, SCREEN_ROWS, SCREEN_COLS, self.scale * 3), dtype=np.uint8)
+            # Tiles without a display keep the background color
+            self._mosaic_rows[count:] = self._lut[0]
+            self._mosaic_layout = layout
+
+        # (rows, 32, scale, columns, 64 * scale * 3) view of the tiles,
+        # without the padding
+        grid = self._mosaic[padding:, padding:].reshape(rows, height + padding, columns, (width + padding) * 3)
+        grid = grid[:, :height, :, :width * 3].reshape(rows, SCREEN_ROWS, self.scale, columns, width * 3)
+
+        scaled = self._mosaic_rows
+        np.take(self._lut, buffers, axis=0, out=scaled[:count], mode='clip')
+        # Copy each row of scaled pixels to the scale rows of its tile
+        tiles = scaled.reshape(rows, columns, SCREEN_ROWS, width * 3).transpose(0, 2, 1, 3)
+        grid[:] = tiles[:, :, None, :, :]
+        return self._mosaic
@@ -0,0 +1,65 @@
+from .core.vm import VM
+from .chip8_env import get_rom_profile
+
+
+class Replay():
+    '''Re-simulates an episode of Chip8Env from its seed and actions.
+
+    The seed and actions are those of an env episode, env.episode_seed and
+    env.actions, frameskip and boot_frames those of the env. Steps only run
+    cycles, without building frames, or drawing at all with headless=True.
+    A snapshot of the VM is kept every checkpoint_interval steps, so seeking
+    into a long episode only replays the steps since the closest checkpoint.
+    '''
+
+    def __init__(self, game, seed, actions, frameskip=0, checkpoint_interval=1000, boot_frames=0, **vm_kwargs):
+        self.seed = seed
+        self.actions = actions
+        self.cycles_per_step = frameskip + 1
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoints = dict()
+
+        self._rom_profile = get_rom_profile(game)
+        self.vm = VM(frame_limiting=False, **vm_kwargs)
+        self.vm.load_profile(self._rom_profile, boot_frames)
+        self.vm.reset(seed=seed)
+        self.step_index = 0
+        self.checkpoints[0] = self.vm.snapshot()
+
+    def __len__(self):
+        return len(self.actions)
+
+    def _advance(self):
+        vm = self.vm
+        action = self.actions[self.step_index]
+        for _ in range(self.cycles_per_step):
+            vm.take_action(action)
+            vm.cycle()
+            # Clear the change flags like the env does, so snapshots match
+            vm.state.output_has_changed()
+
+        self.step_index += 1
+        if self.step_index % self.checkpoint_interval == 0 and self.step_index not in self.checkpoints:
+            self.checkpoints[self.step_index] = vm.snapshot()
+
+    def seek(self, step_index):
+        # Bring the VM to its state after step_index steps and return it
+        if not 0 <= step_index <= len(self.actions):
+            raise IndexError('Step %d is out of the replay' % step_index)
+
+        checkpoint = step_index - step_index % self.checkpoint_interval
+        while checkpoint not in self.checkpoints:
+            checkpoint -= self.checkpoint_interval
+
+        # Only restore a checkpoint if it is closer than the current step
+        if not checkpoint <= self.step_index <= step_index:
+            self.vm.restore(self.checkpoints[checkpoint])
+            self.step_index = checkpoint
+
+        while self.step_index < step_index:
+            self._advance()
+        return self.vm
+
+    def run(self):
+        # Replay the whole episode
+        return self.seek(len(self.actions))
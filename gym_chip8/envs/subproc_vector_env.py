@@ -0,0 +1,161 @@
+import numpy as np
+
+import gym
+import multiprocessing as mp
+import weakref
+from functools import partial
+from multiprocessing import shared_memory
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _reset(env):
+    # Chip8Env.reset returns a rendered image, the first observation of an
+    # env with neither RAM nor pipeline observations is its raw display
+    observation = env.reset()
+    unwrapped = env.unwrapped
+    if unwrapped.headless or unwrapped.pipeline is not None:
+        return observation
+    return unwrapped.vm.get_display().buffer
+
+
+def _shutdown(remotes, processes, shm):
+    # Stop the workers and unlink the shared memory. Views of the ring may
+    # outlive the vector env, the block is unmapped once they are all gone.
+    for remote in remotes:
+        try:
+            remote.send(('close', None))
+        except OSError:
+            pass
+    for process in processes:
+        process.join()
+    for remote in remotes:
+        remote.close()
+    shm.unlink()
+
+
+def _worker(remote, parent_remote, env_fn, index, shm_name, shape, dtype):
+    parent_remote.close()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    observations = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    env = env_fn()
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                action, slot = data
+                observation, reward, done, info = env.step(action)
+                if done:
+                    observation = _reset(env)
+                observations[slot, index] = observation
+                remote.send((reward, done, info))
+            elif cmd == 'reset':
+                observations[data, index] = _reset(env)
+                remote.send(None)
+            elif cmd == 'seed':
+                remote.send(env.seed(data))
+            elif cmd == 'close':
+                break
+            else:
+                raise NotImplementedError(cmd)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        env.close()
+        # Drop the view before closing, the buffer can't be released otherwise
+        del observations
+        shm.close()
+        remote.close()
+
+
+class SubprocVectorEnv(object):
+    '''Steps one Chip8Env per subprocess.
+
+    Workers write their observations (32x64 frames, the RAM of headless
+    envs or the output of a pipeline) into a shared memory ring of
+    ring_size slots, so observations never go through the pipes. Each step
+    returns a (N,) + observation_space.shape view of the current slot,
+    which stays valid for the next ring_size - 1 steps. Environments are
+    reset automatically when done.
+
+    close() stops the workers and releases the shared memory, which is also
+    done once the vector env is garbage collected.
+    '''
+
+    def __init__(self, env_fns, ring_size=2, context=None):
+        self.num_envs = len(env_fns)
+        self.ring_size = ring_size
+        self.closed = False
+        self._slot = 0
+
+        # The spaces are the same for every worker, get them from a local copy
+        env = env_fns[0]()
+        self.action_space = env.action_space
+        self.observation_space = env.observation_space
+        pipeline = getattr(env.unwrapped, 'pipeline', None)
+        dtype = np.dtype(pipeline.dtype if pipeline is not None else np.uint8)
+        env.close()
+
+        shape = (ring_size, self.num_envs) + tuple(self.observation_space.shape)
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * dtype.itemsize)
+        self._observations = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+        # The arrays don't pin the mapping, it is closed after the ring and
+        # all its views are gone, not at exit when they may still be alive
+        weakref.finalize(self._observations, self._shm.close).atexit = False
+
+        ctx = mp.get_context(context)
+        self.remotes, work_remotes = zip(*[ctx.Pipe() for _ in range(self.num_envs)])
+        self.processes = []
+        for index, (work_remote, remote, env_fn) in enumerate(zip(work_remotes, self.remotes, env_fns)):
+            args = (work_remote, remote, env_fn, index, self._shm.name, shape, dtype)
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+        self._shutdown = weakref.finalize(self, _shutdown, self.remotes, self.processes, self._shm)
+
+    @classmethod
+    def from_id(cls, env_id, num_envs, **kwargs):
+        return cls([partial(gym.make, env_id) for _ in range(num_envs)], **kwargs)
+
+    def seed(self, seed=None):
+        # Each worker gets its own seed, derived from the given one
+        for index, remote in enumerate(self.remotes):
+            remote.send(('seed', None if seed is None else seed + index))
+        return [remote.recv() for remote in self.remotes]
+
+    def reset(self):
+        self._slot = (self._slot + 1) % self.ring_size
+        for remote in self.remotes:
+            remote.send(('reset', self._slot))
+        for remote in self.remotes:
+            remote.recv()
+        return self._observations[self._slot]
+
+    def step_async(self, actions):
+        self._slot = (self._slot + 1) % self.ring_size
+        for remote, action in zip(self.remotes, actions):
+            remote.send(('step', (int(action), self._slot)))
+
+    def step_wait(self):
+        results = [remote.recv() for remote in self.remotes]
+        rewards, dones, infos = zip(*results)
+        return self._observations[self._slot], np.array(rewards), np.array(dones), infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self._shutdown()
+        del self._observations
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,119 @@
+import numpy as np
+
+from gym import spaces
+
+from .core.batched import BatchedVM
+from .chip8_env import get_rom_profile
+from .rendering import Renderer
+from .core.constants import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Chip8VectorEnv(object):
+    '''N copies of a CHIP-8 game stepped in lockstep by a BatchedVM.
+
+    step() takes one action index per environment and returns batched
+    observations, rewards and done flags. Finished environments are reset
+    automatically, their last variables are still reported in the info dict.
+    With a pipeline, an ObservationPipeline created with num_envs, the
+    observations are preprocessed from the displays of the BatchedVM.
+    render('rgb_array') returns a mosaic of all the environments, drawn by
+    renderer.
+    '''
+    metadata = {'render.modes': ['rgb_array']}
+
+    def __init__(self, game, num_envs, frameskip=0, seed=None, pipeline=None, renderer=None):
+        self.num_envs = num_envs
+        self.frameskip = frameskip
+        self.pipeline = pipeline
+        self.renderer = renderer if renderer is not None else Renderer()
+        if pipeline is not None and pipeline.num_envs != num_envs:
+            raise ValueError('The observation pipeline is for %s envs, not %d' % (pipeline.num_envs, num_envs))
+
+        self.vm = BatchedVM(num_envs, seed=seed)
+        self.vm.load_profile(get_rom_profile(game))
+
+        self.action_space = spaces.Discrete(self.vm.get_num_actions())
+        if pipeline is not None:
+            self.observation_space = pipeline.observation_space
+        else:
+            self.observation_space = spaces.Box(low=0, high=1, shape=(SCREEN_ROWS, SCREEN_COLS))
+        self.reset()
+
+    def _get_frame_reward(self):
+        raise NotImplementedError
+
+    def _get_done(self):
+        raise NotImplementedError
+
+    def _reset_envs(self, mask):
+        self.vm.reset(mask)
+
+    def reset(self):
+        self._reset_envs(np.ones(self.num_envs, dtype=np.bool_))
+        if self.pipeline is not None:
+            return self.pipeline.reset(self.vm.display)
+        return self.vm.get_display_buffer()
+
+    def step(self, actions):
+        if self.frameskip:
+            num_steps = self.frameskip + 1
+        else:
+            num_steps = 1
+
+        reward = np.zeros(self.num_envs, dtype=np.int64)
+        for _ in range(num_steps):
+            self.vm.take_action(actions)
+            self.vm.cycle()
+            reward += self._get_frame_reward()
+
+        done = self._get_done()
+        info = dict((name, self.vm.get_variable(name)) for name in self.vm._variables)
+
+        if done.any():
+            self._reset_envs(done)
+        if self.pipeline is not None:
+            # The stacks of the envs just reset restart from their first frame
+            observation = self.pipeline.step(self.vm.display)
+            if done.any():
+                self.pipeline.reset(self.vm.display, done, out=observation)
+        else:
+            observation = self.vm.get_display_buffer()
+
+        return observation, reward, done, info
+
+    def render(self, mode='rgb_array', columns=None):
+        # All the environments in a grid of columns tiles wide
+        if mode != 'rgb_array':
+            raise ValueError('Unsupported render mode: %s' % mode)
+        return self.renderer.mosaic(self.vm.display, columns).copy()
+
+    def close(self):
+        pass
+
+
+class Chip8BrixVectorEnv(Chip8VectorEnv):
+    def __init__(self, *args, **kwargs):
+        super().__init__('BRIX', *args, **kwargs)
+
+    def _reset_envs(self, mask):
+        super()._reset_envs(mask)
+        self._previous_score[mask] = 0
+
+    def reset(self):
+        self._previous_score = np.zeros(self.num_envs, dtype=np.int64)
+        return super().reset()
+
+    def _get_frame_reward(self):
+        # Hand out a reward of 1 when the score is increased
+        # (no negative rewards are given for losing lives)
+        score = self.vm.get_variable("score")
+        reward = np.maximum(0, score - self._previous_score)
+        self._previous_score = score
+
+        return reward
+
+    def _get_done(self):
+        return (self.vm.cycle_index > 0) & (self.vm.get_variable("balls_remaining") == 0)
@@ -0,0 +1,375 @@
+import os
+import struct
+import shutil
+import subprocess
+
+import numpy as np
+import gym
+
+from .core.constants import SCREEN_ROWS, SCREEN_COLS, FREQUENCY
+
+# Largest LZW code of GIF images
+GIF_MAX_CODE = 4095
+# Shortest frame delay in 1/100 s, viewers slow down shorter ones
+GIF_MIN_DELAY = 2
+
+
+def _scale(pixels, scale):
+    # Nearest neighbour upscaling of a 2D array
+    return np.repeat(np.repeat(pixels, scale, axis=0), scale, axis=1)
+
+
+def _lzw_codes(pixels, code_size):
+    # GIF LZW codes of the uint8 array pixels, and their widths in bits.
+    # The table maps a code and the next pixel to the code of the longer
+    # string.
+    clear = 1 << code_size
+    width = code_size + 1
+    table = dict()
+    next_code = clear + 2
+    codes = [clear]
+    widths = [width]
+    data = pixels.tobytes()
+    code = data[0]
+    for pixel in data[1:]:
+        key = code << 8 | pixel
+        found = table.get(key)
+        if found is not None:
+            code = found
+            continue
+        codes.append(code)
+        widths.append(width)
+        if next_code <= GIF_MAX_CODE:
+            table[key] = next_code
+            if next_code == 1 << width:
+                width += 1
+            next_code += 1
+        else:
+            # The table is full, start a new one
+            codes.append(clear)
+            widths.append(width)
+            table = dict()
+            next_code = clear + 2
+            width = code_size + 1
+        code = pixel
+    codes.append(code)
+    widths.append(width)
+    # Reading the last code adds an entry to the decoder table, which may
+    # widen the end code
+    if next_code == 1 << width and width < 12:
+        width += 1
+    codes.append(clear + 1)
+    widths.append(width)
+    return np.array(codes, dtype=np.int64), np.array(widths, dtype=np.int64)
+
+
+def _compiled_lzw_codes(pixels, code_size):
+    # Same as _lzw_codes, with an array as the table, for numba
+    clear = 1 << code_size
+    width = code_size + 1
+    table = np.full((GIF_MAX_CODE + 1, clear), -1, dtype=np.int16)
+    next_code = clear + 2
+    codes = np.empty(2 * len(pixels) + 3, dtype=np.int64)
+    widths = np.empty(2 * len(pixels) + 3, dtype=np.int64)
+    codes[0] = clear
+    widths[0] = width
+    count = 1
+    code = np.int64(pixels[0])
+    for index in range(1, len(pixels)):
+        pixel = pixels[index]
+        found = table[code, pixel]
+        if found >= 0:
+            code = np.int64(found)
+            continue
+        codes[count] = code
+        widths[count] = width
+        count += 1
+        if next_code <= GIF_MAX_CODE:
+            table[code, pixel] = next_code
+            if next_code == 1 << width:
+                width += 1
+            next_code += 1
+        else:
+            codes[count] = clear
+            widths[count] = width
+            count += 1
+            table[:] = -1
+            next_code = clear + 2
+            width = code_size + 1
+        code = np.int64(pixel)
+    codes[count] = code
+    widths[count] = width
+    if next_code == 1 << width and width < 12:
+        width += 1
+    codes[count + 1] = clear + 1
+    widths[count + 1] = width
+    return codes[:count + 2], widths[:count + 2]
+
+
+# LZW encoder used by GifEncoder, _compiled_lzw_codes compiled with numba
+# if installed, _lzw_codes otherwise. Set by the first GIF encoded, numba is
+# too slow to import for envs that don't record.
+_lzw_encoder = None
+
+
+def _get_lzw_encoder():
+    global _lzw_encoder
+    if _lzw_encoder is None:
+        try:
+            import numba
+        except ImportError:
+            _lzw_encoder = _lzw_codes
+        else:
+            _lzw_encoder = numba.njit(cache=True)(_compiled_lzw_codes)
+    return _lzw_encoder
+
+
+class GifEncoder(object):
+    '''Writes displays to an animated GIF as they change.
+
+    Each frame only holds the rectangle that changed since the previous one,
+    LZW compressed, and lasts until the next. Frames shorter than
+    GIF_MIN_DELAY are merged into the next one. Only the last display is
+    kept in memory, frames are written as soon as their duration is known.
+    '''
+
+    def __init__(self, file, scale, palette, loop=0):
+        palette = np.array(palette, dtype=np.uint8)
+        if not 1 <= len(palette) <= 256:
+            raise ValueError('GIF palettes have at most 256 colors, got %d' % len(palette))
+        self.file = file
+        self.scale = scale
+
+        # Color tables have 2 ** (size + 1) entries, LZW codes start with
+        # at least 3 bits
+        size = max(0, (len(palette) - 1).bit_length() - 1)
+        self._code_size = max(2, size + 1)
+        table = np.zeros((2 << size, 3), dtype=np.uint8)
+        table[:len(palette)] = palette
+        file.write(b'GIF89a')
+        file.write(struct.pack('<HHBBB', SCREEN_COLS * scale, SCREEN_ROWS * scale, 0xF0 | size, 0, 0))
+        file.write(table.tobytes())
+        # Loop count, 0 loops forever
+        file.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+        # Display shown by the frames written so far, and the pending one
+        # with the time it appears at, in 1/100 s
+        self._shown = None
+        self._pending = np.zeros((SCREEN_ROWS, SCREEN_COLS), dtype=np.uint8)
+        self._pending_time = None
+
+    def write(self, pixels, timestamp):
+        # Show the (32, 64) palette indices pixels from timestamp seconds on
+        time = int(round(timestamp * 100))
+        if self._pending_time is not None:
+            if np.array_equal(pixels, self._pending):
+                return
+            if time - self._pending_time < GIF_MIN_DELAY:
+                # Too short to show, replaced by the new display
+                np.copyto(self._pending, pixels)
+                return
+            self._flush(time)
+        np.copyto(self._pending, pixels)
+        self._pending_time = time
+
+    def _flush(self, time):
+        # Write the pending frame, shown until time
+        pending = self._pending
+        if self._shown is None:
+            top, bottom, left, right = 0, SCREEN_ROWS, 0, SCREEN_COLS
+            self._shown = pending.copy()
+        else:
+            changed = pending != self._shown
+            rows = np.flatnonzero(changed.any(axis=1))
+            if len(rows):
+                cols = np.flatnonzero(changed.any(axis=0))
+                top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            else:
+                # Nothing changed in the end, frames can't be empty
+                top, bottom, left, right = 0, 1, 0, 1
+            np.copyto(self._shown, pending)
+
+        delay = min(max(time - self._pending_time, GIF_MIN_DELAY), 0xFFFF)
+        scale = self.scale
+        # Graphic control extension, the previous frame is kept under this one
+        self.file.write(struct.pack('<4BHBB', 0x21, 0xF9, 4, 1 << 2, delay, 0, 0))
+        self.file.write(struct.pack('<BHHHHB', 0x2C, left * scale, top * scale,
+                                    (right - left) * scale, (bottom - top) * scale, 0))
+        self.file.write(bytes((self._code_size,)))
+        self.file.write(self._encode(_scale(pending[top:bottom, left:right], scale).ravel()))
+
+    def _encode(self, pixels):
+        # LZW compress the uint8 array pixels into GIF sub-blocks, the
+        # codes are packed into bits with NumPy
+        codes, widths = _get_lzw_encoder()(pixels, self._code_size)
+        bits = (codes[:, None] >> np.arange(12)) & 1
+        bits = bits[np.arange(12) < widths[:, None]].astype(np.uint8)
+        codes = np.packbits(bits, bitorder='little')
+
+        # Split into sub-blocks of up to 255 bytes, each prefixed by its
+        # length, and a terminating empty one
+        size = len(codes)
+        blocks = (size + 254) // 255
+        index = np.arange(size)
+        data = np.empty(size + blocks + 1, dtype=np.uint8)
+        data[index + index // 255 + 1] = codes
+        data[0:blocks * 256:256] = 255
+        data[(blocks - 1) * 256] = size - 255 * (blocks - 1)
+        data[-1] = 0
+        return data.tobytes()
+
+    def close(self, timestamp):
+        if self._pending_time is not None:
+            self._flush(int(round(timestamp * 100)))
+        self.file.write(b'\x3B')
+
+
+class Y4MEncoder(object):
+    '''Writes displays to a YUV4MPEG2 stream at a constant frame rate.
+
+    Y4M has no timestamps: the last frame is written again for every frame
+    slot until the display changes. The encoded frame is kept as a single
+    buffer that is written as is. Pixels are converted to full resolution
+    4:4:4 YUV (BT.601) through a lookup table of the palette.
+    '''
+
+    def __init__(self, file, scale, palette, fps=FREQUENCY):
+        self.file = file
+        self.scale = scale
+        self.fps = fps
+        width, height = SCREEN_COLS * scale, SCREEN_ROWS * scale
+        file.write(('YUV4MPEG2 W%d H%d F%d:1 Ip A1:1 C444\n' % (width, height, fps)).encode('ascii'))
+
+        rgb = np.array(palette, dtype=np.float64)
+        yuv = rgb.dot(np.array([[65.481, -37.797, 112.0],
+                                [128.553, -74.203, -93.786],
+                                [24.966, 112.0, -18.214]]) / 255) + (16, 128, 128)
+        # Row of scale pixels of each color, per plane
+        planes = np.round(yuv).astype(np.uint8).T
+        self._lut = np.repeat(planes[:, :, None], scale, axis=2)
+
+        header = b'FRAME\n'
+        self._frame = np.empty(len(header) + 3 * width * height, dtype=np.uint8)
+        self._frame[:len(header)] = np.frombuffer(header, dtype=np.uint8)
+        self._planes = self._frame[len(header):].reshape(3, SCREEN_ROWS, scale, SCREEN_COLS * scale)
+        self._rows = np.empty((SCREEN_ROWS, SCREEN_COLS, scale), dtype=np.uint8)
+        # Frame slots written, and whether _frame holds a frame
+        self._written = 0
+        self._started = False
+
+    def _repeat_until(self, slot):
+        # Write the current frame up to slot, excluded
+        while self._written < slot:
+            self.file.write(self._frame)
+            self._written += 1
+
+    def write(self, pixels, timestamp):
+        # Show the (32, 64) palette indices pixels from timestamp seconds on
+        slot = int(round(timestamp * self.fps))
+        if self._started:
+            self._repeat_until(slot)
+        else:
+            self._written = slot
+            self._started = True
+        rows = self._rows
+        width = SCREEN_COLS * self.scale
+        for lut, plane in zip(self._lut, self._planes):
+            np.take(lut, pixels, axis=0, out=rows, mode='clip')
+            plane[:] = rows.reshape(SCREEN_ROWS, 1, width)
+
+    def close(self, timestamp):
+        if self._started:
+            self._repeat_until(max(int(round(timestamp * self.fps)), self._written + 1))
+
+
+class FFmpegEncoder(Y4MEncoder):
+    '''Pipes a Y4M stream to ffmpeg, which encodes it to path.'''
+
+    def __init__(self, path, scale, palette, fps=FREQUENCY):
+        self._process = subprocess.Popen(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'yuv4mpegpipe', '-i', '-', '-pix_fmt', 'yuv420p', path],
+            stdin=subprocess.PIPE)
+        super().__init__(self._process.stdin, scale, palette, fps)
+
+    def close(self, timestamp):
+        super().close(timestamp)
+        self._process.stdin.close()
+        if self._process.wait():
+            raise IOError('ffmpeg failed to encode the video, exit status %d' % self._process.returncode)
+
+
+class VideoRecorder(gym.Wrapper):
+    '''Streams the displays of an env to a video file while it steps.
+
+    The format follows the extension of path: .gif and .y4m are encoded
+    here, any other extension is encoded by ffmpeg if installed. A frame is
+    only encoded when the display was drawn since the last one, and is
+    timestamped by the number of cycles run, at FREQUENCY cycles per
+    second. Episodes follow each other in the video. Memory use doesn't
+    depend on the length of the recording.
+
+    Frames are scaled and colored like the renders of the env, or by
+    renderer, a Renderer.
+    '''
+
+    def __init__(self, env, path, renderer=None, fps=FREQUENCY):
+        super().__init__(env)
+        self.path = path
+        self.encoder = None
+        self._file = None
+        self._vm = env.unwrapped.vm
+        if self._vm.headless:
+            raise ValueError('Headless envs have no frames to record')
+        renderer = renderer if renderer is not None else env.unwrapped.renderer
+
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.gif':
+            self._file = open(path, 'wb')
+            self.encoder = GifEncoder(self._file, renderer.scale, renderer.palette)
+        elif extension == '.y4m':
+            self._file = open(path, 'wb')
+            self.encoder = Y4MEncoder(self._file, renderer.scale, renderer.palette, fps)
+        elif shutil.which('ffmpeg') is not None:
+            self.encoder = FFmpegEncoder(path, renderer.scale, renderer.palette, fps)
+        else:
+            raise ValueError('Encoding %s videos needs ffmpeg, use .gif or .y4m instead' % extension)
+
+        # Cycles run since the recording started, and the display version
+        # last encoded
+        self._cycles = None
+        self._display = None
+        self._version = None
+
+    @property
+    def timestamp(self):
+        # Time of the current frame in the video, in seconds
+        return self._cycles / FREQUENCY
+
+    def _write(self, force=False):
+        display = self._vm.get_display()
+        if force or display is not self._display or display.version != self._version:
+            self.encoder.write(display.buffer, self.timestamp)
+            self._display = display
+            self._version = display.version
+
+    def _step(self, action):
+        result = self.env.step(action)
+        self._cycles += self.env.unwrapped.frameskip + 1
+        self._write()
+        return result
+
+    def _reset(self, **kwargs):
+        observation = self.env.reset(**kwargs)
+        # The new episode starts on the next frame
+        self._cycles = 0 if self._cycles is None else self._cycles + 1
+        self._write(force=True)
+        return observation
+
+    def _close(self):
+        if self.encoder is not None:
+            # The last frame lasts a cycle
+            self.encoder.close(self.timestamp + 1.0 / FREQUENCY if self._cycles is not None else 0)
+            if self._file is not None:
+                self._file.close()
+            self.encoder = None
+        return super()._close()
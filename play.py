@@ -3,7 +3,16 @@
 import gym
 import gym_chip8.envs as _
 from gym.utils.play import play
+from gym_chip8.envs.core.pacing import FrameLimiter
 
 if __name__ == '__main__':
     env = gym.make("Chip8Brix-v0")
-    play(env, zoom=16, fps=60)
+
+    # Pace the VM itself, busy-waiting the last 2ms of each frame for a
+    # steady 60Hz, play's own clock is set high enough not to interfere
+    vm = env.unwrapped.vm
+    vm.frame_limiter = FrameLimiter(policy='drop', spin=0.002)
+    vm.enable_frame_limiting()
+    play(env, zoom=16, fps=1000)
+
+    print(vm.frame_limiter)
@@ -2,5 +2,12 @@ from setuptools import setup
 
 setup(name='gym_chip8',
       version='0.0.1',
-      install_requires=['gym>=0.9.2']
+      install_requires=['gym>=0.9.2'],
+      extras_require={
+          # Compiled VMPool kernel and GIF encoder
+          'fast': ['numba'],
+      },
+      entry_points={
+          'console_scripts': ['gym-chip8-bench = gym_chip8.bench:main'],
+      },
 )
@@ -0,0 +1,65 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from gym_chip8.envs import Chip8BrixEnv
+
+WARMUP_STEPS = 300
+STEPS = 5000
+# Blocks and bytes retained by caches filled while stepping, e.g. bound
+# opcode handlers, whatever the number of steps
+MAX_CACHED_BLOCKS = 100
+MAX_CACHED_SIZE = 4096
+
+
+def measure_steps(env, steps):
+    # Blocks and bytes retained after steps, and the largest peak of bytes
+    # allocated during a single step. The action log grows by design, it
+    # is emptied between steps.
+    env.seed(0)
+    env.reset()
+    for index in range(WARMUP_STEPS):
+        env.step(index % 3)
+    del env.actions[:]
+
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    peak = 0
+    for index in range(steps):
+        del env.actions[:]
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        env.step(index % 3)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+    del env.actions[:]
+    end = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    # Ignore the snapshots themselves
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = end.filter_traces(filters).compare_to(start.filter_traces(filters), 'lineno')
+    return sum(stat.count_diff for stat in stats), sum(stat.size_diff for stat in stats), peak
+
+
+@pytest.mark.parametrize('observation_buffers', [1, 2, 4])
+def test_step_with_observation_buffers_allocates_nothing(observation_buffers):
+    env = Chip8BrixEnv(observation_buffers=observation_buffers)
+    blocks, size, peak = measure_steps(env, STEPS)
+
+    # Nothing accumulates from step to step
+    assert blocks < MAX_CACHED_BLOCKS
+    assert size < MAX_CACHED_SIZE
+    # No observation, image or variables array is allocated per step, only
+    # short-lived Python objects
+    frame_size = env.observation_space.shape[0] * env.observation_space.shape[1]
+    assert peak < frame_size
+
+
+def test_observation_buffers_are_reused():
+    buffers = [np.zeros((32, 64), dtype=np.uint8) for _ in range(2)]
+    env = Chip8BrixEnv(observation_buffers=buffers)
+    for index in range(10):
+        observation = env.step(index % 3)[0]
+        assert observation.base is buffers[index % 2]
+        assert not observation.flags.writeable
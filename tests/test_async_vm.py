@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import pytest
+
+from gym_chip8.envs.core.vm import VM
+from gym_chip8.envs.core.async_vm import AsyncVM, FrameClock
+
+
+class ManualClock(object):
+    # Ticks only move forward when waited for, or when the test stalls
+    def __init__(self):
+        self.tick = 0
+        self.waits = []
+
+    def get_tick(self):
+        return self.tick
+
+    async def wait(self, tick):
+        self.waits.append(tick)
+        self.tick = max(self.tick, tick)
+
+
+def run_waits(async_vm, count):
+    async def waits():
+        for _ in range(count):
+            await async_vm.wait()
+    asyncio.run(waits())
+
+
+@pytest.mark.parametrize('stall', [3, 5])
+def test_catch_up_runs_late_ticks_within_max_lag(stall):
+    clock = ManualClock()
+    async_vm = AsyncVM(VM(), clock, max_lag=5)
+    run_waits(async_vm, 3)
+    clock.tick += stall
+    del clock.waits[:]
+
+    run_waits(async_vm, stall + 3)
+    # Every late tick is run, back to back, then the schedule goes on
+    assert clock.waits == list(range(4, 4 + stall + 3))
+    assert async_vm.dropped_ticks == 0
+
+
+def test_catch_up_drops_ticks_beyond_max_lag():
+    clock = ManualClock()
+    async_vm = AsyncVM(VM(), clock, max_lag=5)
+    run_waits(async_vm, 3)
+    clock.tick += 100
+    del clock.waits[:]
+
+    run_waits(async_vm, 3)
+    assert clock.waits == [103, 104, 105]
+    assert async_vm.dropped_ticks == 99
+
+
+def test_drop_realigns_on_the_current_tick():
+    clock = ManualClock()
+    async_vm = AsyncVM(VM(), clock, policy='drop')
+    run_waits(async_vm, 3)
+    clock.tick += 2
+    del clock.waits[:]
+
+    run_waits(async_vm, 2)
+    assert clock.waits == [5, 6]
+    assert async_vm.dropped_ticks == 1
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        AsyncVM(VM(), ManualClock(), policy='skip')
+
+
+def test_stalled_loop_does_not_replay_every_tick():
+    # 100 ticks late after the stall, only max_lag of them may be run
+    clock = FrameClock(frequency=1000)
+    async_vm = AsyncVM(VM(), clock, max_lag=5)
+
+    async def session():
+        for _ in range(3):
+            await async_vm.cycle()
+        time.sleep(0.1)
+        start = clock.get_tick()
+        for _ in range(10):
+            await async_vm.cycle()
+        return clock.get_tick() - start
+
+    elapsed = asyncio.run(session())
+    assert async_vm.dropped_ticks >= 90
+    # The last cycles waited for their ticks again
+    assert elapsed >= 4
@@ -0,0 +1,41 @@
+import numpy as np
+
+from gym_chip8.envs.core.vm import VM
+from gym_chip8.envs.core.batched import BatchedVM
+from gym_chip8.envs.chip8_env import get_rom_profile
+
+
+def test_batched_vm_matches_vms_with_the_same_seeds():
+    seeds = [0, 1, 12345, 2**62]
+    batched = BatchedVM(len(seeds), seed=0)
+    batched.load_profile(get_rom_profile('BRIX'))
+    batched.reset(seeds=seeds)
+    vms = []
+    for seed in seeds:
+        vm = VM()
+        vm.load_profile(get_rom_profile('BRIX'))
+        vm.reset(seed=seed)
+        vms.append(vm)
+
+    actions = np.random.RandomState(0)
+    for cycle in range(2000):
+        action = actions.randint(batched.get_num_actions(), size=len(seeds))
+        batched.take_action(action)
+        batched.cycle()
+        for index, vm in enumerate(vms):
+            vm.take_action(int(action[index]))
+            vm.cycle()
+        if cycle % 100 == 99:
+            for index, vm in enumerate(vms):
+                assert np.array_equal(batched.V[index], np.frombuffer(vm.state.V, dtype=np.uint8))
+                assert batched.rng[index] == vm.state.rng
+                assert np.array_equal(batched.display[index], vm.get_display().buffer)
+
+
+def test_batched_vm_draws_episode_seeds():
+    first, second = BatchedVM(3, seed=7), BatchedVM(3, seed=7)
+    assert np.array_equal(first.episode_seeds, second.episode_seeds)
+    assert len(set(first.episode_seeds)) == 3
+    first.reset(np.array([False, True, False]))
+    assert first.episode_seeds[0] == second.episode_seeds[0]
+    assert first.episode_seeds[1] != second.episode_seeds[1]
@@ -0,0 +1,66 @@
+import random
+
+import numpy as np
+import pytest
+
+from gym_chip8.envs.core.vm import VM
+from gym_chip8.envs.core.state import seed_rng
+from gym_chip8.envs.chip8_env import get_rom_profile
+from gym_chip8.envs.core.constants import PROGRAM_OFFSET, MEMORY_SIZE
+
+
+def make_vm(cpu_mode, headless=False):
+    vm = VM(cpu_mode=cpu_mode, headless=headless)
+    vm.load_profile(get_rom_profile('BRIX'))
+    vm.reset(seed=1)
+    return vm
+
+
+def run(vm, cycles, seed=0):
+    # Take pseudo random actions, the same for every VM given the seed
+    actions = random.Random(seed)
+    for _ in range(cycles):
+        vm.take_action(actions.randrange(vm.get_num_actions()))
+        vm.cycle()
+
+
+@pytest.mark.parametrize('cycles', [1, 10, 500, 3000])
+def test_jit_snapshot_matches_interpreter(cycles):
+    interpreter = make_vm('interpreter')
+    jit = make_vm('jit')
+    run(interpreter, cycles)
+    run(jit, cycles)
+    assert jit.snapshot() == interpreter.snapshot()
+
+
+def test_jit_ram_matches_interpreter_headless():
+    interpreter = make_vm('interpreter', headless=True)
+    jit = make_vm('jit', headless=True)
+    for _ in range(20):
+        run(interpreter, 100)
+        run(jit, 100)
+        assert np.array_equal(jit.get_ram(), interpreter.get_ram())
+
+
+def test_jit_matches_interpreter_on_random_code():
+    # Straight-line blocks of random instructions, stores overwriting code
+    # included. Invalid instructions and errors must happen at the same
+    # point in both modes.
+    code = random.Random(2)
+    for _ in range(20):
+        program = bytes(code.randrange(256) for _ in range(MEMORY_SIZE - PROGRAM_OFFSET))
+        vms = [VM(cpu_mode=cpu_mode) for cpu_mode in ('interpreter', 'jit')]
+        errors = []
+        for vm in vms:
+            # A reset would throw the program away, seed the state instead
+            vm.load_rom_data(program)
+            vm.state.rng = seed_rng(3)
+            assert bytes(vm.state.memory[PROGRAM_OFFSET:]) == program
+            try:
+                for _ in range(50):
+                    vm.cycle()
+                errors.append(None)
+            except IndexError as error:
+                errors.append(type(error))
+        assert errors[0] == errors[1]
+        assert vms[1].snapshot() == vms[0].snapshot()
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from gym_chip8.envs.core.vm import VM
+from gym_chip8.envs.core.pool import VMPool
+from gym_chip8.envs.chip8_env import get_rom_profile
+
+
+def make_vm(seed):
+    vm = VM()
+    vm.load_profile(get_rom_profile('BRIX'))
+    vm.reset(seed=seed)
+    return vm
+
+
+@pytest.mark.parametrize('use_kernel', [True, False])
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_pool_matches_vm_cycle(use_kernel, max_workers):
+    count = 7
+    pool_vms = [make_vm(seed) for seed in range(count)]
+    vms = [make_vm(seed) for seed in range(count)]
+    # A profiled VM is always stepped by VM.cycle
+    pool_vms[0].enable_profiling()
+
+    actions = np.random.RandomState(0)
+    with VMPool(pool_vms, max_workers=max_workers, use_kernel=use_kernel) as pool:
+        for _ in range(50):
+            action = actions.randint(vms[0].get_num_actions(), size=count)
+            displays = pool.step(action, cycles=4)
+            for _ in range(4):
+                for vm, vm_action in zip(vms, action):
+                    vm.take_action(int(vm_action))
+                    vm.cycle()
+            for index, vm in enumerate(vms):
+                assert np.array_equal(displays[index], vm.get_display().buffer)
+                assert pool_vms[index].state.rng == vm.state.rng
+                assert bytes(pool_vms[index].state.memory) == bytes(vm.state.memory)
+
+
+def test_pool_add_to_i_with_vf():
+    # LD VF, 5; LD I, 0x300; ADD I, VF; JP 0x206. VF is set to the carry
+    # before being added to I, so I stays 0x300.
+    program = bytes([0x6F, 0x05, 0xA3, 0x00, 0xFF, 0x1E, 0x12, 0x06])
+    pool_vms = [VM() for _ in range(2)]
+    for vm in pool_vms:
+        vm.load_rom_data(program)
+    vm = VM()
+    vm.load_rom_data(program)
+
+    with VMPool(pool_vms, max_workers=1) as pool:
+        pool.step()
+    vm.cycle()
+    assert vm.state.I == 0x300
+    for pool_vm in pool_vms:
+        assert pool_vm.state.I == vm.state.I
+        assert pool_vm.state.V[0xF] == vm.state.V[0xF]
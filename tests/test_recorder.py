@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from gym_chip8.envs import Chip8BrixEnv, ObservationPipeline, TrajectoryRecorder, TrajectoryReader
+
+
+@pytest.mark.parametrize('make_kwargs', [
+    lambda: dict(),
+    lambda: dict(observation_buffers=2),
+    lambda: dict(pipeline=ObservationPipeline(downscale=2, stack=4, output='float32')),
+])
+def test_recorded_frames_are_displays(make_kwargs, tmpdir):
+    directory = str(tmpdir.join('trajectories'))
+    env = TrajectoryRecorder(Chip8BrixEnv(**make_kwargs()), directory)
+    vm = env.unwrapped.vm
+    env.reset()
+    displays = [vm.get_display().buffer.copy()]
+    for index in range(20):
+        env.step(index % 3)
+        displays.append(vm.get_display().buffer.copy())
+    env.close()
+
+    reader = TrajectoryReader(directory)
+    assert len(reader.frames) == len(displays)
+    frames = np.unpackbits(np.asarray(reader.frames), axis=1).reshape(-1, 32, 64)
+    assert np.array_equal(frames, displays)
+    assert reader.steps['first'][0] and not reader.steps['first'][1:].any()
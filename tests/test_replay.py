@@ -0,0 +1,20 @@
+from gym_chip8.envs import Chip8BrixEnv, Replay
+
+
+def test_replay_after_restore_state():
+    env = Chip8BrixEnv(frameskip=1)
+    env.seed(0)
+    env.reset()
+    for index in range(60):
+        env.step(index % 3)
+    state = env.clone_state()
+    # Steps undone by restoring the state
+    for index in range(60):
+        env.step((index + 1) % 3)
+    env.restore_state(state)
+    for index in range(60):
+        env.step((index + 2) % 3)
+
+    assert len(env.actions) == 120
+    replay = Replay('BRIX', env.episode_seed, env.actions, frameskip=1)
+    assert replay.seek(len(env.actions)).snapshot() == env.vm.snapshot()
@@ -0,0 +1,62 @@
+import gc
+import os
+from functools import partial
+
+import numpy as np
+import pytest
+
+from gym_chip8.envs import Chip8BrixEnv, SubprocVectorEnv, ObservationPipeline
+
+
+def make_env(seed, make_kwargs):
+    env = Chip8BrixEnv(**make_kwargs())
+    env.seed(seed)
+    return env
+
+
+@pytest.mark.parametrize('make_kwargs', [
+    lambda: dict(),
+    lambda: dict(headless=True),
+    lambda: dict(max_pool=True, frameskip=2),
+    # Every env needs its own pipeline
+    lambda: dict(pipeline=ObservationPipeline(downscale=2, stack=3, output='float32')),
+])
+def test_observations_match_local_envs(make_kwargs):
+    num_envs = 2
+    env_fns = [partial(make_env, seed, make_kwargs) for seed in range(num_envs)]
+    local_envs = [env_fn() for env_fn in env_fns]
+    local_observations = [env.reset() for env in local_envs]
+
+    with SubprocVectorEnv(env_fns, context='fork') as vector_env:
+        observations = vector_env.reset()
+        assert observations.shape == (num_envs,) + tuple(vector_env.observation_space.shape)
+        for env, observation, local_observation in zip(local_envs, observations, local_observations):
+            if np.shape(local_observation) != observation.shape:
+                # Chip8Env.reset returns a rendered image
+                local_observation = env.vm.get_display().buffer
+            assert np.array_equal(observation, local_observation)
+
+        for index in range(50):
+            actions = [index % 3] * num_envs
+            observations, rewards, dones, _ = vector_env.step(actions)
+            for env, observation, action, done in zip(local_envs, observations, actions, dones):
+                local_observation, _, local_done, _ = env.step(action)
+                assert done == local_done
+                if not done:
+                    assert np.array_equal(observation, local_observation)
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason='shared memory is not listed in /dev/shm')
+def test_dropped_vector_env_releases_its_workers_and_memory():
+    vector_env = SubprocVectorEnv([partial(Chip8BrixEnv) for _ in range(2)], context='fork')
+    name = vector_env._shm.name.lstrip('/')
+    processes = vector_env.processes
+    observations = vector_env.step([0, 1])[0]
+
+    del vector_env
+    gc.collect()
+    assert name not in os.listdir('/dev/shm')
+    assert not any(process.is_alive() for process in processes)
+    # Views of the ring stay readable
+    assert observations.shape == (2, 32, 64)
+    assert observations.max() <= 1
@@ -0,0 +1,136 @@
+import io
+import struct
+
+import numpy as np
+import pytest
+
+from gym_chip8.envs import Chip8BrixEnv, VideoRecorder
+from gym_chip8.envs import video
+from gym_chip8.envs.rendering import PALETTE
+
+
+def lzw_decode(data, code_size):
+    # Reference GIF LZW decoder, the end code must be read exactly at the
+    # end of the data
+    clear, end = 1 << code_size, (1 << code_size) + 1
+    bits = int.from_bytes(data, 'little')
+    total = len(data) * 8
+    position = 0
+    width = code_size + 1
+    table = None
+    previous = None
+    pixels = []
+    while True:
+        assert position + width <= total, 'no end code'
+        code = (bits >> position) & ((1 << width) - 1)
+        position += width
+        if code == clear:
+            table = [bytes((value,)) for value in range(clear)] + [b'', b'']
+            width = code_size + 1
+            previous = None
+            continue
+        if code == end:
+            break
+        if previous is None:
+            entry = table[code]
+        else:
+            entry = table[code] if code < len(table) else previous + previous[:1]
+            if len(table) < 4096:
+                table.append(previous + entry[:1])
+                if len(table) == 1 << width and width < 12:
+                    width += 1
+        pixels.append(entry)
+        previous = entry
+    # Only the padding of the last byte is left
+    assert total - position < 8
+    return np.frombuffer(b''.join(pixels), dtype=np.uint8)
+
+
+def read_blocks(data, position):
+    # Data of the sub-blocks at position, and the position after them
+    chunks = []
+    while data[position]:
+        chunks.append(data[position + 1:position + 1 + data[position]])
+        position += data[position] + 1
+    return b''.join(chunks), position + 1
+
+
+def decode_gif(data):
+    # Palette and (image, delay) of every frame of a GIF
+    assert data[:6] == b'GIF89a'
+    width, height, flags = struct.unpack('<HHB', data[6:11])
+    colors = 2 << (flags & 7)
+    palette = np.frombuffer(data[13:13 + 3 * colors], dtype=np.uint8).reshape(colors, 3)
+    position = 13 + 3 * colors
+    image = np.zeros((height, width), dtype=np.uint8)
+    frames = []
+    delay = None
+    while data[position] != 0x3B:
+        if data[position] == 0x21:
+            if data[position + 1] == 0xF9:
+                delay = struct.unpack('<H', data[position + 4:position + 6])[0]
+            position = read_blocks(data, position + 2)[1]
+        else:
+            assert data[position] == 0x2C
+            left, top, frame_width, frame_height = struct.unpack('<HHHH', data[position + 1:position + 9])
+            code_size = data[position + 10]
+            codes, position = read_blocks(data, position + 11)
+            pixels = lzw_decode(codes, code_size)
+            image[top:top + frame_height, left:left + frame_width] = pixels.reshape(frame_height, frame_width)
+            frames.append((image.copy(), delay))
+    return palette, frames
+
+
+def encode(pixels, code_size):
+    encoder = video.GifEncoder(io.BytesIO(), 1, PALETTE)
+    encoder._code_size = code_size
+    data, position = read_blocks(encoder._encode(pixels), 0)
+    return data
+
+
+def random_images():
+    random_state = np.random.RandomState(0)
+    images = [np.zeros(count, dtype=np.uint8) for count in (1, 2, 3, 4, 5, 6, 64, 1000)]
+    for _ in range(50):
+        size = random_state.randint(1, 5000)
+        colors = random_state.randint(1, 5)
+        images.append(random_state.randint(0, colors, size).astype(np.uint8))
+        images.append(np.repeat(images[-1][:size // 8 + 1], 8))
+    # Long enough to fill the code table
+    images.append(random_state.randint(0, 4, 100000).astype(np.uint8))
+    return images
+
+
+@pytest.mark.parametrize('lzw_encoder', [video._lzw_codes, video._compiled_lzw_codes, None])
+@pytest.mark.parametrize('code_size', [2, 3, 8])
+def test_lzw_round_trip(lzw_encoder, code_size, monkeypatch):
+    # None tests the default encoder, compiled if numba is installed
+    monkeypatch.setattr(video, '_lzw_encoder', lzw_encoder)
+    for pixels in random_images():
+        assert np.array_equal(lzw_decode(encode(pixels, code_size), code_size), pixels)
+
+
+def test_gif_recording_round_trip(tmpdir):
+    path = str(tmpdir.join('episode.gif'))
+    env = VideoRecorder(Chip8BrixEnv(frameskip=1), path)
+    env.seed(0)
+    env.reset()
+    # Display shown from each time, in 1/100 s
+    displays = [(0, env.unwrapped.vm.get_display().buffer.copy())]
+    for index in range(300):
+        env.step(index % 3)
+        displays.append((int(round(env.timestamp * 100)), env.unwrapped.vm.get_display().buffer.copy()))
+    end = int(round((env.timestamp + 1 / 60) * 100))
+    env.close()
+
+    with open(path, 'rb') as gif_file:
+        palette, frames = decode_gif(gif_file.read())
+    assert np.array_equal(palette[:2], PALETTE)
+    start = 0
+    for image, delay in frames:
+        assert delay >= video.GIF_MIN_DELAY
+        # The last display shown before the end of the frame
+        display = [buffer for time, buffer in displays if time < start + delay][-1]
+        assert np.array_equal(image, video._scale(display, 8))
+        start += delay
+    assert abs(start - end) <= video.GIF_MIN_DELAY